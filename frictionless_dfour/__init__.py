@@ -1,3 +1,25 @@
-from .dfour import *
+import importlib
 from .program import program
-from frictionless import system
+
+
+# The storages are imported on first access, so plugin discovery and the
+# command line don't pay for gql, requests and frictionless up front
+
+_exports = {
+    "DfourPlugin": ".plugin",
+    "DfourDialect": ".dfour",
+    "DfourStorage": ".dfour",
+    "AsyncDfourStorage": ".aio",
+}
+
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
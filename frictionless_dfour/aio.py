@@ -0,0 +1,478 @@
+import asyncio
+import functools
+from graphql import GraphQLError
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+from frictionless import Package, errors
+from frictionless.exception import FrictionlessException
+from .dfour import DfourDialect, DfourStorage
+from . import client
+from . import helpers
+from . import protocol
+from . import tracing
+
+
+# Storage
+
+
+class AsyncDfourStorage:
+    """Asynchronous dfour storage implementation
+
+    The asyncio counterpart of `DfourStorage` built on aiohttp. All calls of
+    one storage share its connection pools: one for GraphQL and one for the
+    authenticated session used by uploads. Use it as an async context manager
+    or call `close()` when done.
+
+    ```python
+    async with AsyncDfourStorage(url, dialect=dialect) as storage:
+        async for snapshot in storage:
+            ...
+        pkg = await storage.read_package()
+        await storage.write_package(pkg, force=True)
+    ```
+
+    Parameters:
+        source (string): dfour instance url e.g. "https://sandbox.dfour.space"
+        dialect? (DfourDialect): dfour dialect
+        limit? (int): maximum number of simultaneous connections per pool
+
+    API      | Usage
+    -------- | --------
+    Public   | `from frictionless_dfour import AsyncDfourStorage`
+    """
+
+    def __init__(self, source, *, dialect=None, limit=100):
+        dialect = dialect or DfourDialect()
+        self.__url = source.rstrip("/")
+        self.__endpoint = f"{self.__url}/graphql/"
+        self.__snapshotHash = dialect.snapshotHash
+        self.__workspaceHash = dialect.workspaceHash
+        self.__username = dialect.username
+        self.__password = dialect.password
+        self.__bfsMuniciaplity = dialect.bfsMunicipality
+        self.__snapshotTopic = dialect.snapshotTopic
+        self.__fetchSchema = dialect.fetchSchema
+        self.__compression = dialect.compression
+        self.__limit = limit
+        self.__graphql = None
+        self.__http = None
+        self.__sessionid = None
+        self.__workspaceSnapshots = None
+        self.__packages = helpers.LRUCache(dialect.cacheSize)
+        self.__httpCache = dialect.httpCache
+        self.__lazy = None
+        self.__lock = None
+        self.__snapshots_lock = None
+        self.__dialect = dialect
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self):
+        """Open the connection pools, done on first use otherwise"""
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+            self.__snapshots_lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__graphql is None:
+                self.__graphql = await self.__connect()
+
+    async def close(self):
+        """Close the connection pools and remove the files of lazy packages"""
+        if self.__lazy is not None:
+            self.__lazy.close()
+            self.__lazy = None
+        if self.__graphql is not None:
+            await self.__graphql.client.close_async()
+            self.__graphql = None
+        if self.__http is not None:
+            await self.__http.close()
+            self.__http = None
+            self.__sessionid = None
+
+    def __aiter__(self):
+        return self.__iterate()
+
+    async def __iterate(self):
+        if self.__workspaceHash:
+            params = {"wshash": protocol.dfour_id(self.__workspaceHash, False)}
+
+            results = await self.__make_dfour_request(
+                protocol.WORKSPACE_SNAPSHOTS, params
+            )
+            for snapshot in results["workspace"]["snapshots"] or []:
+                yield snapshot
+
+    # Read
+
+    async def read_package(self, **options):
+        hash = options.get("snapshotHash") or self.__snapshotHash
+        cache = options.get("cache", True)
+        lazy = options.get("lazy", self.__dialect.lazyData)
+        pkg = self.__packages.get((hash, lazy)) if cache else None
+        if pkg is not None:
+            return pkg
+
+        if lazy:
+            # Spilling resource data is file bound and runs off the event loop,
+            # the files live as long as the storage reading them
+            if self.__lazy is None:
+                self.__lazy = DfourStorage(self.__url, dialect=self.__dialect)
+            read = functools.partial(
+                self.__lazy.read_package, snapshotHash=hash, lazy=True, cache=False
+            )
+            pkg = await asyncio.get_event_loop().run_in_executor(None, read)
+        elif self.__httpCache:
+            data = await self.__download_snapshot(hash)
+            pkg = Package(descriptor=data) if data is not None else None
+        else:
+            data = await self.__query_snapshot(hash)
+            pkg = Package(descriptor=data) if data is not None else None
+
+        if pkg is not None:
+            if cache:
+                self.__packages.set((hash, lazy), pkg)
+            return pkg
+
+        note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
+        raise FrictionlessException(errors.StorageError(note=note))
+
+    async def read_packages(self, hashes, **options):
+        batches = protocol.batch_hashes(hashes)
+        results = await asyncio.gather(*map(self.__read_batch, batches))
+        return [package for result in results for package in result]
+
+    async def read_workspace_packages(self, **options):
+        params = {"wshash": protocol.dfour_id(self.__workspaceHash, False)}
+
+        result = await self.__make_dfour_request(protocol.WORKSPACE_PACKAGES, params)
+
+        if not result["workspace"]:
+            note = f'Workspace with hash "{self.__workspaceHash}" on {self.__url} doesn\'t exist'
+            raise FrictionlessException(errors.StorageError(note=note))
+        snapshots = result["workspace"]["snapshots"] or []
+        return [Package(descriptor=snapshot["data"]) for snapshot in snapshots]
+
+    async def read_resource(self, name, **options):
+        pkg = await self.read_package(**options)
+        return pkg.get_resource(name)
+
+    def clear_cache(self, hash=None):
+        if hash is None:
+            self.__packages.clear()
+        else:
+            self.__packages.pop((hash, False))
+            self.__packages.pop((hash, True))
+
+    # Write
+
+    async def write_package(self, package, *, force=False, **options):
+        if not (self.__workspaceHash and self.__username and self.__password):
+            note = f'Uploading "{package.title}" on {self.__url} needs a workspace hash and login credentials.'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+        await self.__dfour_login()
+
+        if self.__snapshotHash:
+            pk = self.__snapshotHash
+        else:
+            # Concurrent uploads of a new title must not create it twice
+            async with self.__snapshots_lock:
+                pk = await self.__resolve_snapshot(package)
+
+        await self.__upload_file(package, pk, options.get("progress"))
+        self.clear_cache(pk)
+
+    # Helpers
+
+    async def __resolve_snapshot(self, package):
+        if package.title in await self.__get_workspace_snapshots():
+            return self.__workspaceSnapshots[package.title]
+        elif self.__snapshotTopic and self.__bfsMuniciaplity:
+            result = await self.__mutate_snapshot(
+                protocol.snapshot_input(
+                    self.__workspaceHash,
+                    package.title,
+                    self.__snapshotTopic,
+                    self.__bfsMuniciaplity,
+                )
+            )
+            pk = result["snapshotmutation"]["snapshot"]["pk"]
+            self.__workspaceSnapshots[package.title] = pk
+            return pk
+        else:
+            note = f'Uploading "{package.title}" on {self.__url} requires a municiaplity bfs number and a snapshot topic, set one via the DfourDialect.'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+    async def __mutate_snapshot(self, params):
+        retry = True
+        while True:
+            sessionid = self.__sessionid
+            try:
+                return await self.__execute_login(protocol.SNAPSHOT_MUTATION, params)
+            except (TransportQueryError, TransportServerError) as error:
+                # A reused session might have expired in the meantime
+                if retry and client.is_login_error(error):
+                    retry = False
+                    await self.__dfour_login(rejected=sessionid)
+                    continue
+                title = params["data"]["title"]
+                note = f'Saving snapshot "{title}" on {self.__url} failed: {error}'
+                raise FrictionlessException(errors.StorageError(note=note))
+
+    async def __query_snapshot(self, hash):
+        params = {"hash": protocol.dfour_id(hash)}
+
+        result = await self.__make_dfour_request(protocol.SNAPSHOT, params)
+
+        if result["snapshot"]:
+            return result["snapshot"]["data"]
+
+    async def __download_snapshot(self, hash):
+        params = {"hash": protocol.dfour_id(hash)}
+
+        result = await self.__make_dfour_request(protocol.SNAPSHOT_DATAFILE, params)
+
+        if not result["snapshot"]:
+            return None
+        if not result["snapshot"]["datafile"]:
+            return await self.__query_snapshot(hash)
+
+        # The HTTP cache is synchronous and runs off the event loop
+        def load(url, key):
+            return helpers.load_json(client.download(url, key=key))
+
+        url = protocol.datafile_url(self.__url, result["snapshot"]["datafile"])
+        key = protocol.datafile_key(self.__url, hash)
+        return await asyncio.get_event_loop().run_in_executor(None, load, url, key)
+
+    async def __read_batch(self, hashes):
+        query, params = protocol.batch_query(hashes)
+
+        result = await self.__make_dfour_request(query, params)
+
+        packages = []
+        for hash, data in zip(hashes, protocol.batch_data(hashes, result)):
+            if data is None:
+                note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
+                raise FrictionlessException(errors.StorageError(note=note))
+            packages.append(Package(descriptor=data))
+        return packages
+
+    async def __make_dfour_request(self, query, params):
+        await self.open()
+        operation = client.get_operation(query)
+        with tracing.span(
+            "graphql", url=self.__endpoint, operation=operation
+        ) as span:
+            # The span is filled in by the trace config, see `record_spans`
+            extra_args = {"trace_request_ctx": span}
+            request, arguments = client.execute_args(query, params)
+            try:
+                return await self.__graphql.execute(
+                    request, **arguments, extra_args=extra_args
+                )
+            except GraphQLError:
+                if not getattr(self.__graphql.client, "schema_cached", False):
+                    raise
+                # The server schema changed since it was cached
+                await self.__refresh_schema()
+                return await self.__graphql.execute(
+                    request, **arguments, extra_args=extra_args
+                )
+
+    async def __execute_login(self, query, params):
+        # Sent on the login session, cookies of the response must not end up
+        # in the shared anonymous one, see `client.execute_login`
+        await self.open()
+        if self.__fetchSchema:
+            try:
+                self.__graphql.client.validate(query)
+            except GraphQLError:
+                if not getattr(self.__graphql.client, "schema_cached", False):
+                    raise
+                await self.__refresh_schema()
+                self.__graphql.client.validate(query)
+        token = self.__get_cookies().get("csrftoken", "")
+        payload, headers = client.graphql_request(self.__endpoint, query, params, token)
+        operation = client.get_operation(query)
+        with tracing.span("graphql", url=self.__endpoint, operation=operation) as span:
+            async with self.__http.post(
+                self.__endpoint, json=payload, headers=headers
+            ) as response:
+                content = await response.read()
+                span.status = response.status
+                span.bytes = len(content)
+        return client.graphql_result(response.status, response.reason, content)
+
+    async def __refresh_schema(self):
+        await self.__graphql.fetch_schema()
+        self.__graphql.client.schema_cached = False
+        client.write_schema_cache(self.__endpoint, self.__graphql.client.introspection)
+
+    async def __upload_file(self, package, pk, progress=None):
+        loop = asyncio.get_event_loop()
+        uploadUrl = protocol.upload_url(self.__url, pk)
+        filename = protocol.upload_filename(pk, package)
+        retry = protocol.UploadRetry(self.__url, self.__compression)
+
+        # Encoding and compression are CPU bound and run off the event loop
+        def create_body(file, encoding):
+            return client.MultipartFile(
+                "data_file", filename, file, encoding=encoding, progress=progress
+            )
+
+        def spool():
+            data = helpers.inline_lazy_data(package)
+            return helpers.spool_json(data, separators=(",", ":"), fast=True)
+
+        with await loop.run_in_executor(None, spool) as file:
+            body = await loop.run_in_executor(None, create_body, file, retry.encoding)
+            while True:
+                sessionid = self.__sessionid
+                headers = {
+                    "X-CSRFToken": self.__get_cookies()["csrftoken"],
+                    "Content-Length": str(len(body)),
+                    **body.headers,
+                }
+
+                with tracing.span("upload", url=uploadUrl) as span:
+                    async with self.__http.patch(
+                        uploadUrl, headers=headers, data=self.__stream(body)
+                    ) as response:
+                        span.bytes = len(body)
+                        span.status = status = response.status
+                        text = await response.text()
+
+                action = retry.check(status, response.url)
+                if action == retry.LOGIN:
+                    await self.__dfour_login(rejected=sessionid)
+                    continue
+                if action == retry.UNCOMPRESS:
+                    body.close()
+                    body = await loop.run_in_executor(None, create_body, file, None)
+                    continue
+                break
+            body.close()
+
+        if status >= 400:
+            note = f'Uploading "{package.title}" on {self.__url} failed: {status} {text[:200]}'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+    # Internal
+
+    async def __connect(self):
+        import aiohttp
+        from gql import Client
+        from gql.transport.aiohttp import AIOHTTPTransport
+
+        cached = None
+        if self.__fetchSchema:
+            cached = client.read_schema_cache(client.schema_cache_path(self.__endpoint))
+        transport = AIOHTTPTransport(
+            url=self.__endpoint,
+            client_session_args={
+                "connector": aiohttp.TCPConnector(limit=self.__limit),
+                "trace_configs": [record_spans()],
+            },
+            **client.json_options(AIOHTTPTransport),
+        )
+        gql_client = Client(
+            transport=transport,
+            introspection=cached["introspection"] if cached else None,
+            fetch_schema_from_transport=False,
+        )
+        session = await gql_client.connect_async()
+        if self.__fetchSchema and not cached:
+            await session.fetch_schema()
+            client.write_schema_cache(self.__endpoint, gql_client.introspection)
+        gql_client.schema_cached = bool(cached)
+        return session
+
+    async def __get_workspace_snapshots(self):
+        if self.__workspaceSnapshots is None:
+            self.__workspaceSnapshots = {}
+            async for item in self:
+                self.__workspaceSnapshots.setdefault(item["title"], item["pk"])
+        return self.__workspaceSnapshots
+
+    async def __stream(self, body):
+        for chunk in body:
+            yield chunk
+
+    def __get_cookies(self):
+        from yarl import URL
+
+        cookies = self.__http.cookie_jar.filter_cookies(URL(self.__url))
+        return {name: morsel.value for name, morsel in cookies.items()}
+
+    async def __dfour_login(self, rejected=None):
+        import aiohttp
+
+        await self.open()
+        async with self.__lock:
+            # Logged in already, or again after the rejected session
+            if self.__sessionid and self.__sessionid != rejected:
+                return
+
+            username, password = protocol.get_credentials(
+                self.__username, self.__password
+            )
+
+            if self.__http is None:
+                # Unsafe cookie jars accept cookies of instances addressed by IP
+                self.__http = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.__limit),
+                    cookie_jar=aiohttp.CookieJar(unsafe=True),
+                )
+            self.__http.cookie_jar.clear()
+            self.__sessionid = None
+
+            with tracing.span("login", url=self.__url) as span:
+                async with self.__http.get(client.login_url(self.__url)) as response:
+                    await response.read()
+                    span.status = response.status
+                token = self.__get_cookies().get("csrftoken")
+                if token:
+                    headers, payload = client.login_form(
+                        self.__url, token, username, password
+                    )
+                    async with self.__http.post(
+                        client.login_url(self.__url), data=payload, headers=headers
+                    ) as response:
+                        await response.read()
+                        span.status = response.status
+
+            self.__sessionid = self.__get_cookies().get("sessionid")
+            if not self.__sessionid:
+                note = f"Couldn't obtain {self.__url} session for {username}."
+                raise FrictionlessException(errors.StorageError(note=note))
+
+
+# Helpers
+
+
+def record_spans():
+    """aiohttp trace config recording responses on their span
+
+    Requests pass the span as `trace_request_ctx`, its status and size are
+    set once the response arrives.
+    """
+    import aiohttp
+
+    async def on_request_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.status = params.response.status
+
+    async def on_response_chunk_received(session, context, params):
+        span = context.trace_request_ctx
+        if span is not None:
+            span.bytes = (span.bytes or 0) + len(params.chunk)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_end.append(on_request_end)
+    config.on_response_chunk_received.append(on_response_chunk_received)
+    return config
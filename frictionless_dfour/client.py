@@ -0,0 +1,757 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import inspect
+import requests
+import tempfile
+import threading
+import urllib.parse
+from uuid import uuid4
+from collections import Counter
+from gql import Client, gql
+from gql.transport.requests import RequestsHTTPTransport
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+from graphql import (
+    GraphQLError,
+    build_client_schema,
+    get_introspection_query,
+    print_ast,
+)
+from requests.adapters import HTTPAdapter
+from . import helpers
+from . import config
+from . import tracing
+
+
+# Sessions
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(endpoint, *, schema=True):
+    """Shared GraphQL session for an endpoint
+
+    The session keeps one pooled keep-alive connection per endpoint. With
+    `schema` enabled the schema is loaded from the on-disk schema cache and
+    only introspected when the cache is missing or older than `config.SCHEMA_TTL`.
+
+    Parameters:
+        endpoint (str): GraphQL endpoint url e.g. "https://sandbox.dfour.space/graphql/"
+        schema? (bool): validate queries against the dfour schema
+
+    Returns:
+        SyncClientSession: connected gql session
+    """
+    key = (endpoint, schema)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            transport = RequestsHTTPTransport(
+                url=endpoint, **json_options(RequestsHTTPTransport)
+            )
+            client = Client(transport=transport, fetch_schema_from_transport=False)
+            session = client.connect_sync()
+            mount_pool(transport.session)
+            if schema:
+                load_schema(session, endpoint)
+            _sessions[key] = session
+        return session
+
+
+def json_options(transport_class):
+    """gql transport options parsing responses with `helpers.loads_json`
+
+    gql takes a `json_deserialize` option since 3.5, older versions parse
+    responses with the stdlib.
+    """
+    if "json_deserialize" in inspect.signature(transport_class).parameters:
+        return {"json_deserialize": helpers.loads_json}
+    return {}
+
+
+def record_span(span, options=None):
+    """gql transport options recording the responses of a request on a span
+
+    The status and size of the responses are recorded by a request hook.
+    Other `extra_args` in `options` are kept.
+
+    Returns:
+        dict: options for `session.execute`
+    """
+
+    def record(response, **kwargs):
+        span.status = response.status_code
+        span.bytes = (span.bytes or 0) + len(response.content)
+
+    options = dict(options or {})
+    hooks = {"response": [record]}
+    options["extra_args"] = {**options.get("extra_args", {}), "hooks": hooks}
+    return options
+
+
+def execute(endpoint, document, variable_values=None, *, schema=True, **options):
+    """Execute a GraphQL document on the shared session of an endpoint
+
+    A document failing validation against a cached schema triggers one
+    schema refresh and a retry, as the server schema might have changed.
+
+    Parameters:
+        endpoint (str): GraphQL endpoint url
+        document (DocumentNode): query parsed with `gql`
+        variable_values? (dict): query variables
+        schema? (bool): validate queries against the dfour schema
+        **options: passed on to the gql session e.g. `extra_args`
+
+    Returns:
+        dict: query result
+    """
+    session = get_session(endpoint, schema=schema)
+    request, arguments = execute_args(document, variable_values)
+    operation = get_operation(document)
+    with tracing.span("graphql", url=endpoint, operation=operation) as span:
+        options = record_span(span, options)
+        try:
+            return session.execute(request, **arguments, **options)
+        except GraphQLError:
+            if not getattr(session.client, "schema_cached", False):
+                raise
+            with _sessions_lock:
+                load_schema(session, endpoint, refresh=True)
+            return session.execute(request, **arguments, **options)
+
+
+def execute_args(document, variable_values=None):
+    """Request and keyword arguments of `session.execute` for a document
+
+    Since gql 4 `gql` returns a `GraphQLRequest` carrying the variables,
+    older versions return the document and take the variables next to it.
+
+    Returns:
+        (GraphQLRequest|DocumentNode, dict): request and keyword arguments
+    """
+    if hasattr(document, "document"):
+        return type(document)(document, variable_values=variable_values), {}
+    return document, {"variable_values": variable_values}
+
+
+def get_document(document):
+    """Parsed document of a `gql` result, see `execute_args`"""
+    return getattr(document, "document", document)
+
+
+def execute_login(session, endpoint, document, variable_values=None, *, schema=True):
+    """Execute a GraphQL document on an authenticated session of `get_login`
+
+    Mutations aren't sent on the shared anonymous session, so cookies set
+    by the response e.g. a rotated `sessionid` only end up in the session
+    of their user. The document is validated like in `execute`.
+
+    Parameters:
+        session (requests.Session): logged in session
+        endpoint (str): GraphQL endpoint url
+        document (DocumentNode): query parsed with `gql`
+        variable_values? (dict): query variables
+        schema? (bool): validate queries against the dfour schema
+
+    Returns:
+        dict: query result
+
+    Raises:
+        TransportServerError: the server answered with an error status
+        TransportQueryError: the result has errors
+    """
+    if schema:
+        validate(endpoint, document)
+    token = session.cookies.get("csrftoken", "")
+    payload, headers = graphql_request(endpoint, document, variable_values, token)
+    operation = get_operation(document)
+    with tracing.span("graphql", url=endpoint, operation=operation) as span:
+        response = session.post(endpoint, json=payload, headers=headers)
+        span.status = response.status_code
+        span.bytes = len(response.content)
+    return graphql_result(response.status_code, response.reason, response.content)
+
+
+def graphql_request(endpoint, document, variable_values, token):
+    """JSON payload and headers of an authenticated GraphQL request
+
+    Returns:
+        (dict, dict): payload and headers
+    """
+    query = print_ast(get_document(document))
+    payload = {"query": query, "variables": variable_values or {}}
+    headers = {"X-CSRFToken": token, "Referer": endpoint}
+    return payload, headers
+
+
+def graphql_result(status, reason, content):
+    """Data of a GraphQL response
+
+    Raises:
+        TransportServerError: the server answered with an error status
+        TransportQueryError: the result has errors
+    """
+    if status >= 400:
+        raise TransportServerError(f"{status} {reason}", status)
+    result = helpers.loads_json(content)
+    if result.get("errors"):
+        raise TransportQueryError(
+            str(result["errors"][0]), errors=result["errors"], data=result.get("data")
+        )
+    return result["data"]
+
+
+LOGIN_ERRORS = ["permission", "authenticat", "logged in", "login", "csrf"]
+
+
+def is_login_error(error):
+    """Whether a GraphQL transport error means the session isn't logged in
+
+    Error statuses 401 and 403 and GraphQL errors about permissions or
+    authentication count, other errors e.g. invalid input don't.
+    """
+    if isinstance(error, TransportServerError):
+        return error.code in (401, 403)
+    if isinstance(error, TransportQueryError):
+        messages = [item.get("message", "") for item in error.errors or []]
+        text = " ".join(messages or [str(error)]).lower()
+        return any(word in text for word in LOGIN_ERRORS)
+    return False
+
+
+def validate(endpoint, document):
+    """Validate a GraphQL document against the schema of an endpoint
+
+    A document failing validation against a cached schema triggers one
+    schema refresh before it's validated again.
+    """
+    session = get_session(endpoint, schema=True)
+    try:
+        session.client.validate(document)
+    except GraphQLError:
+        if not getattr(session.client, "schema_cached", False):
+            raise
+        with _sessions_lock:
+            load_schema(session, endpoint, refresh=True)
+        session.client.validate(document)
+
+
+def execute_stream(endpoint, document, variable_values=None):
+    """Execute a GraphQL document without reading the response
+
+    The query is sent on the shared anonymous session and not validated
+    against the schema. The raw JSON response is left to the caller, e.g.
+    for `helpers.stream_json`.
+
+    Parameters:
+        endpoint (str): GraphQL endpoint url
+        document (DocumentNode): query parsed with `gql`
+        variable_values? (dict): query variables
+
+    Returns:
+        requests.Response: streamed response, close it when done
+    """
+    query = print_ast(get_document(document))
+    payload = {"query": query, "variables": variable_values or {}}
+    operation = get_operation(document)
+    with tracing.span("graphql", url=endpoint, operation=operation) as span:
+        response = get_http().post(endpoint, json=payload, stream=True)
+        span.status = response.status_code
+    if not response.ok:
+        response.close()
+        from frictionless import errors
+        from frictionless.exception import FrictionlessException
+
+        note = f"Query on {endpoint} failed: {response.status_code} {response.reason}"
+        raise FrictionlessException(errors.StorageError(note=note))
+    response.raw.decode_content = True
+    return response
+
+
+def get_operation(document):
+    """Name of the first operation of a `gql` document or request"""
+    for definition in get_document(document).definitions:
+        if getattr(definition, "name", None):
+            return definition.name.value
+    return None
+
+
+def close_sessions():
+    """Close all shared GraphQL sessions"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.client.close_sync()
+        _sessions.clear()
+
+
+def mount_pool(session):
+    """Mount a connection pool sized by `config.POOL_SIZE` on a requests session"""
+    adapter = HTTPAdapter(
+        pool_connections=config.POOL_SIZE, pool_maxsize=config.POOL_SIZE
+    )
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, adapter)
+    return session
+
+
+atexit.register(close_sessions)
+
+
+_http = None
+
+
+def get_http():
+    """Shared anonymous requests session with a connection pool"""
+    global _http
+    with _sessions_lock:
+        if _http is None:
+            _http = mount_pool(requests.Session())
+        return _http
+
+
+def head(url):
+    """Request the headers of a url on the shared session
+
+    Servers not supporting HEAD get a streamed GET that is closed
+    without reading the body.
+
+    Returns:
+        requests.Response: response
+    """
+    with tracing.span("head", url=url) as span:
+        response = get_http().head(url, allow_redirects=True)
+        if response.status_code in (405, 501):
+            with get_http().get(url, stream=True) as response:
+                pass
+        span.status = response.status_code
+    return response
+
+
+# Schema
+
+
+def load_schema(session, endpoint, *, refresh=False):
+    """Attach the schema of an endpoint to a session
+
+    The introspection result is cached per endpoint on disk. An expired or
+    refreshed entry is replaced by a new introspection, queries failing
+    validation against a cached schema refresh it (see `execute`).
+
+    Parameters:
+        session (SyncClientSession): connected gql session
+        endpoint (str): GraphQL endpoint url
+        refresh? (bool): ignore the cached schema
+    """
+    cached = None if refresh else read_schema_cache(schema_cache_path(endpoint))
+    if cached:
+        introspection = cached["introspection"]
+    else:
+        with tracing.span("introspection", url=endpoint) as span:
+            # `gql` wraps the query in a `GraphQLRequest` on gql 4
+            result = session.transport.execute(
+                gql(get_introspection_query()), **record_span(span)
+            )
+        if result.errors:
+            raise GraphQLError(f"Introspection of {endpoint} failed: {result.errors}")
+        introspection = result.data
+        write_schema_cache(endpoint, introspection)
+    session.client.introspection = introspection
+    session.client.schema = build_client_schema(introspection)
+    session.client.schema_cached = bool(cached)
+
+
+def read_schema_cache(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as file:
+            cached = json.load(file)
+    except ValueError:
+        return None
+    if time.time() - cached.get("fetched", 0) > config.SCHEMA_TTL:
+        return None
+    return cached
+
+
+def write_schema_cache(endpoint, introspection):
+    cache = {
+        "endpoint": endpoint,
+        "fetched": time.time(),
+        "introspection": introspection,
+    }
+    helpers.write_atomic(schema_cache_path(endpoint), json.dumps(cache))
+
+
+def schema_cache_path(endpoint):
+    digest = hashlib.sha256(endpoint.encode("utf-8")).hexdigest()[:16]
+    return helpers.cache_path("schemas", f"{digest}.json")
+
+
+# Logins
+
+
+_logins = {}
+_logins_lock = threading.Lock()
+
+
+def get_login(url, username, password, *, rejected=None, persist=False):
+    """Shared authenticated session for a dfour instance and user
+
+    Sessions are reused until the server rejects them. Callers pass the
+    rejected session back in to log in again, which happens only once even
+    if several callers report the same session. With `persist` enabled the
+    session cookies are also kept on disk across runs.
+
+    Parameters:
+        url (str): dfour instance url e.g. "https://sandbox.dfour.space"
+        username (str): dfour username
+        password (str): dfour password
+        rejected? (requests.Session): session the server didn't accept
+        persist? (bool): read and write the session cookies on disk
+
+    Returns:
+        requests.Session: session, logged in if it carries a `sessionid` cookie
+    """
+    key = (url, username)
+    with _logins_lock:
+        session = _logins.get(key)
+        if session is not None and session is rejected:
+            del _logins[key]
+            session = None
+        if session is None and persist and rejected is None:
+            session = read_login_cache(url, username)
+        if session is None:
+            session = login(url, username, password)
+            if persist and "sessionid" in session.cookies.keys():
+                write_login_cache(url, username, session)
+        if "sessionid" in session.cookies.keys():
+            _logins[key] = session
+        return session
+
+
+def login(url, username, password):
+    """Log in to a dfour instance with a new requests session"""
+    session = mount_pool(requests.Session())
+    with tracing.span("login", url=url) as span:
+        response = session.get(login_url(url))
+        span.status = response.status_code
+        token = session.cookies.get("csrftoken")
+        if token:
+            headers, payload = login_form(url, token, username, password)
+            # make sure the CORS-Token cookie is set
+            headers["Cookie"] = f"csrftoken={token}"
+            response = session.post(
+                login_url(url),
+                data=urllib.parse.urlencode(payload),
+                headers=headers,
+            )
+            span.status = response.status_code
+    return session
+
+
+def login_url(url):
+    return f"{url}/account/login/"
+
+
+def login_form(url, token, username, password):
+    """Headers and form fields logging in to a dfour instance
+
+    Returns:
+        (dict, dict): headers and form fields
+    """
+    headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Referer": login_url(url),
+    }
+    payload = {
+        "csrfmiddlewaretoken": token,
+        "username": username,
+        "password": password,
+    }
+    return headers, payload
+
+
+def read_login_cache(url, username):
+    path = helpers.cache_path("sessions.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as file:
+            cookies = json.load(file).get(f"{username}@{url}", [])
+    except ValueError:
+        return None
+    now = time.time()
+    cookies = [item for item in cookies if not item["expires"] or item["expires"] > now]
+    if "sessionid" not in [item["name"] for item in cookies]:
+        return None
+    session = mount_pool(requests.Session())
+    for item in cookies:
+        session.cookies.set(
+            item["name"],
+            item["value"],
+            domain=item["domain"],
+            path=item["path"],
+            secure=item["secure"],
+            expires=item["expires"],
+        )
+    return session
+
+
+def write_login_cache(url, username, session):
+    path = helpers.cache_path("sessions.json")
+    logins = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as file:
+                logins = json.load(file)
+        except ValueError:
+            pass
+    logins[f"{username}@{url}"] = [
+        dict(
+            name=cookie.name,
+            value=cookie.value,
+            domain=cookie.domain,
+            path=cookie.path,
+            secure=cookie.secure,
+            expires=cookie.expires,
+        )
+        for cookie in session.cookies
+    ]
+    helpers.write_atomic(path, json.dumps(logins), mode=0o600)
+
+
+# Downloads
+
+
+def download(url, *, key=None):
+    """Download a url through the on-disk HTTP cache
+
+    Responses are stored content-addressed by their sha256 hash together
+    with their ETag and Last-Modified validators. Cached urls are requested
+    with `If-None-Match`/`If-Modified-Since` and a 304 response is served
+    from the cache, so unchanged files cost a round trip without a body.
+    Downloads with the same `key` replace each other, e.g. the successive
+    datafiles of a snapshot, and a replaced blob is removed unless another
+    cache entry has the same content.
+
+    Parameters:
+        url (str): url to download
+        key? (str): cache key, the url by default
+
+    Returns:
+        str: path of the cached file, don't change it
+    """
+    entry_path = http_cache_path(key or url)
+    entry = read_http_entry(entry_path)
+    headers = {}
+    # Validators of another url don't tell whether the content is the same
+    if entry and entry["url"] == url and os.path.exists(blob_path(entry["digest"])):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"):
+            headers["If-Modified-Since"] = entry["lastModified"]
+
+    with tracing.span("download", url=url) as span, get_http().get(
+        url, headers=headers, stream=True
+    ) as response:
+        span.status = response.status_code
+        if response.status_code == 304 and headers:
+            return blob_path(entry["digest"])
+        if not response.ok:
+            from frictionless import errors
+            from frictionless.exception import FrictionlessException
+
+            note = f'Downloading "{url}" failed: {response.status_code} {response.reason}'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+        # Stream into the blob directory and name the file by its hash
+        digest = hashlib.sha256()
+        dirname = os.path.dirname(blob_path("0"))
+        fd, temp = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                span.bytes = 0
+                for chunk in response.iter_content(config.CHUNK_SIZE):
+                    digest.update(chunk)
+                    file.write(chunk)
+                    span.bytes += len(chunk)
+            path = blob_path(digest.hexdigest())
+            os.replace(temp, path)
+        except Exception:
+            os.remove(temp)
+            raise
+
+        previous = entry
+        entry = {
+            "url": url,
+            "etag": response.headers.get("etag"),
+            "lastModified": response.headers.get("last-modified"),
+            "digest": digest.hexdigest(),
+        }
+        with _blobs_lock:
+            refs = get_blob_refs()
+            helpers.write_atomic(entry_path, json.dumps(entry))
+            refs[entry["digest"]] += 1
+            if previous and previous.get("digest"):
+                refs[previous["digest"]] -= 1
+                if refs[previous["digest"]] <= 0:
+                    del refs[previous["digest"]]
+                    try:
+                        os.remove(blob_path(previous["digest"]))
+                    except FileNotFoundError:
+                        pass
+    return path
+
+
+_blobs = {}
+_blobs_lock = threading.Lock()
+
+
+def get_blob_refs():
+    """Number of cached urls per blob digest, hold `_blobs_lock`
+
+    The cache entries are read once per cache directory and process, later
+    downloads of the process keep the counts up to date.
+    """
+    dirname = os.path.dirname(helpers.cache_path("http", ""))
+    refs = _blobs.get(dirname)
+    if refs is None:
+        refs = _blobs[dirname] = Counter()
+        for name in os.listdir(dirname):
+            entry = read_http_entry(os.path.join(dirname, name))
+            if entry and entry.get("digest"):
+                refs[entry["digest"]] += 1
+    return refs
+
+
+def read_http_entry(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except ValueError:
+        return None
+
+
+def http_cache_path(url):
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return helpers.cache_path("http", f"{digest}.json")
+
+
+def blob_path(digest):
+    return helpers.cache_path("blobs", digest)
+
+
+def clear_http_cache():
+    """Remove all cached downloads"""
+    with _blobs_lock:
+        for name in ("http", "blobs"):
+            shutil.rmtree(helpers.cache_path(name, ""), ignore_errors=True)
+        _blobs.clear()
+
+
+# Uploads
+
+
+_uncompressed = set()
+
+
+def accepts_encoding(url):
+    """Whether uploads to a dfour instance may use a content encoding"""
+    return url not in _uncompressed
+
+
+def reject_encoding(url):
+    """Send further uploads to a dfour instance without content encoding"""
+    _uncompressed.add(url)
+
+
+class MultipartFile:
+    """Streaming multipart/form-data body with a single file field
+
+    The body streams the file in `config.CHUNK_SIZE` blocks with a known
+    Content-Length and can be sent more than once e.g. for retries. With an
+    `encoding` the whole body is compressed into a spooled temporary file
+    first and sent with the matching Content-Encoding.
+
+    Parameters:
+        name (str): form field name
+        filename (str): file name
+        file (file): binary file positioned at its start
+        content_type? (str): content type of the file
+        encoding? (str): "gzip" or "zstd" content encoding of the body
+        progress? (func): called with bytes sent and total bytes while streaming
+    """
+
+    def __init__(
+        self,
+        name,
+        filename,
+        file,
+        *,
+        content_type="application/json",
+        encoding=None,
+        progress=None,
+    ):
+        boundary = uuid4().hex
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        self.__head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        self.__tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.__file = file
+        self.__start = file.tell()
+        file.seek(0, os.SEEK_END)
+        self.__size = file.tell() - self.__start
+        self.__progress = progress
+        self.__encoded = None
+        if encoding:
+            self.headers["Content-Encoding"] = encoding
+            self.__encoded = tempfile.SpooledTemporaryFile(max_size=config.SPOOL_SIZE)
+            compressor = helpers.create_compressor(encoding)
+            for chunk in self.__iter_chunks():
+                self.__encoded.write(compressor.compress(chunk))
+            self.__encoded.write(compressor.flush())
+            self.__file.seek(self.__start)
+
+    def __len__(self):
+        if self.__encoded:
+            self.__encoded.seek(0, os.SEEK_END)
+            return self.__encoded.tell()
+        return len(self.__head) + self.__size + len(self.__tail)
+
+    def __iter__(self):
+        total = len(self)
+        sent = 0
+        if self.__encoded:
+            self.__encoded.seek(0)
+            chunks = iter(lambda: self.__encoded.read(config.CHUNK_SIZE), b"")
+        else:
+            chunks = self.__iter_chunks()
+        for chunk in chunks:
+            yield chunk
+            sent += len(chunk)
+            if self.__progress:
+                self.__progress(sent, total)
+
+    def close(self):
+        if self.__encoded:
+            self.__encoded.close()
+
+    def __iter_chunks(self):
+        self.__file.seek(self.__start)
+        yield self.__head
+        while True:
+            chunk = self.__file.read(config.CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield self.__tail
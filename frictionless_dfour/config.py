@@ -13,3 +13,32 @@ def read_asset(*paths):
 # General
 
 VERSION = read_asset("VERSION")
+CACHE_NAME = "frictionless-dfour"
+
+
+# Network
+
+POOL_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 20
+PACKAGE_CACHE_SIZE = 16
+SCHEMA_TTL = int(os.environ.get("DFOUR_SCHEMA_TTL", 24 * 60 * 60))
+
+
+# Json
+
+JSON_BACKEND = os.environ.get("DFOUR_JSON_BACKEND", "auto")
+JSON_DEPTH = 5
+JSON_BATCH = 256
+SPOOL_SIZE = 8 * 1024 * 1024
+LAZY_PREFIX = "frictionless-dfour-"
+
+
+# Hashing
+
+HASH_ALGORITHM = os.environ.get("DFOUR_HASH_ALGORITHM", "sha256")
+
+
+# Workspace
+
+CONFIG_CHECKPOINT = 50
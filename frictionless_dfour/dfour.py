@@ -1,13 +1,16 @@
-import os
-import json
-import base64
-import requests
-import urllib.parse
-from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
+import shutil
+import weakref
+import tempfile
+from contextlib import contextmanager
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+from . import client
+from . import config
+from . import helpers
+from . import protocol
+from . import tracing
+from .plugin import DfourPlugin  # noqa
 
 from frictionless import (
-    Plugin,
     Dialect,
     Storage,
     Metadata,
@@ -17,28 +20,6 @@ from frictionless import (
 from frictionless.exception import FrictionlessException
 
 
-# Plugin
-
-
-class DfourPlugin(Plugin):
-    """Plugin for dfour
-    API      | Usage
-    -------- | --------
-    Public   | `from frictionless_dfour import DfourPlugin`
-    """
-
-    code = "dfour"
-    status = "experimental"
-
-    def create_dialect(self, resource, *, descriptor):
-        if resource.format == "dfour":
-            return DfourDialect(descriptor)
-
-    def create_storage(self, name, source, **options):
-        if name == "dfour":
-            return DfourStorage(source, **options)
-
-
 # Dialect
 
 
@@ -52,6 +33,12 @@ class DfourDialect(Dialect):
         snapshotHash? (str): snapshotHash
         workspaceHash? (str): workspaceHash
         credentials? (dict): credentials
+        fetchSchema? (bool): validate queries against the (cached) dfour schema (default: true)
+        persistSession? (bool): keep the login session on disk across runs (default: false)
+        compression? (str): compress uploads with "gzip" or "zstd", falls back to uncompressed uploads if the server doesn't support it
+        cacheSize? (int): number of read snapshots kept in memory, 0 disables the cache (default: 16)
+        httpCache? (bool): download snapshot data files through the on-disk HTTP cache (default: false)
+        lazyData? (bool): keep inline resource data in temporary files until it's read, requires ijson (default: false)
     Raises:
         FrictionlessException: raise any error that occurs during the process
     """
@@ -66,6 +53,12 @@ class DfourDialect(Dialect):
         password=None,
         snapshotTopic=None,
         bfsMunicipality=None,
+        fetchSchema=None,
+        persistSession=None,
+        compression=None,
+        cacheSize=None,
+        httpCache=None,
+        lazyData=None,
     ):
         self.setinitial("snapshotHash", snapshotHash)
         self.setinitial("workspaceHash", workspaceHash)
@@ -73,6 +66,12 @@ class DfourDialect(Dialect):
         self.setinitial("password", password)
         self.setinitial("snapshotTopic", snapshotTopic)
         self.setinitial("bfsMunicipality", bfsMunicipality)
+        self.setinitial("fetchSchema", fetchSchema)
+        self.setinitial("persistSession", persistSession)
+        self.setinitial("compression", compression)
+        self.setinitial("cacheSize", cacheSize)
+        self.setinitial("httpCache", httpCache)
+        self.setinitial("lazyData", lazyData)
         super().__init__(descriptor)
 
     @Metadata.property
@@ -99,6 +98,30 @@ class DfourDialect(Dialect):
     def bfsMunicipality(self):
         return self.get("bfsMunicipality")
 
+    @Metadata.property
+    def fetchSchema(self):
+        return self.get("fetchSchema", True)
+
+    @Metadata.property
+    def persistSession(self):
+        return self.get("persistSession", False)
+
+    @Metadata.property
+    def compression(self):
+        return self.get("compression")
+
+    @Metadata.property
+    def cacheSize(self):
+        return self.get("cacheSize", config.PACKAGE_CACHE_SIZE)
+
+    @Metadata.property
+    def httpCache(self):
+        return self.get("httpCache", False)
+
+    @Metadata.property
+    def lazyData(self):
+        return self.get("lazyData", False)
+
     # Metadata
 
     metadata_profile = {  # type: ignore
@@ -112,6 +135,12 @@ class DfourDialect(Dialect):
             "password": {"type": "string"},
             "snapshotTopic": {"type": "string"},
             "bfsMunicipality": {"type": "number"},
+            "fetchSchema": {"type": "boolean"},
+            "persistSession": {"type": "boolean"},
+            "compression": {"type": "string", "enum": ["gzip", "zstd"]},
+            "cacheSize": {"type": "integer", "minimum": 0},
+            "httpCache": {"type": "boolean"},
+            "lazyData": {"type": "boolean"},
         },
     }
 
@@ -142,30 +171,38 @@ class DfourStorage(Storage):
         self.__password = dialect.password
         self.__bfsMuniciaplity = dialect.bfsMunicipality
         self.__snapshotTopic = dialect.snapshotTopic
+        self.__fetchSchema = dialect.fetchSchema
+        self.__persistSession = dialect.persistSession
+        self.__compression = dialect.compression
         self.__sessionid = None
-        self.__workspaceSnapshots = [item["title"] for item in list(self)]
+        self.__workspaceSnapshots = helpers.SnapshotIndex()
+        self.__packages = helpers.LRUCache(dialect.cacheSize)
+        self.__httpCache = dialect.httpCache
+        self.__lazyData = dialect.lazyData
+        self.__tempdirs = []
+        weakref.finalize(self, helpers.remove_dirs, self.__tempdirs)
         self.__dialect = dialect
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Remove the temporary files of the lazy packages read so far
+
+        They are also removed once the storage is garbage collected.
+        """
+        helpers.remove_dirs(self.__tempdirs)
+
     def __iter__(self):
         snapshotsInWorkspace = []
 
         if self.__workspaceHash:
-            query = gql(
-                """
-                query getsnapshotsinworkspace($wshash: ID!) {
-                    workspace(id:$wshash){
-                        snapshots{
-                            pk
-                            title
-                        }
-                    }
-                }
-                """
-            )
+            params = {"wshash": protocol.dfour_id(self.__workspaceHash, False)}
 
-            params = {"wshash": self.__dfour_id(self.__workspaceHash, False)}
-
-            results = self.__make_dfour_request(query, params)
+            results = self.__make_dfour_request(protocol.WORKSPACE_SNAPSHOTS, params)
             if results["workspace"]["snapshots"]:
                 snapshotsInWorkspace = results["workspace"]["snapshots"]
 
@@ -173,91 +210,156 @@ class DfourStorage(Storage):
 
     # Read
     def read_package(self, **options):
-        # Provide a GraphQL query
-        query = gql(
-            """
-            query getsnapshot($hash: ID!) {
-                snapshot(id: $hash) {
-                    data
-                }
-            }
-            """
-        )
-
-        params = {"hash": self.__dfour_id(self.__snapshotHash)}
+        """Read a snapshot
+
+        Read snapshots are cached by hash, see `clear_cache`. The cached
+        package is shared by all reads, copy it before changing it.
+
+        Lazy packages have the inline data of their resources replaced by
+        the `path` of a temporary file, removed when the storage is closed
+        (see `close`), so copies of the package can read it too. Use
+        `resource.read_data()` to get the data of eager and lazy packages.
+
+        Parameters:
+            snapshotHash? (str): snapshot to read instead of the dialect's one
+            cache? (bool): use the snapshot cache (default: true)
+            lazy? (bool): read a lazy package (default: dialect's `lazyData`)
+
+        Returns:
+            Package: package
+        """
+        hash = options.get("snapshotHash") or self.__snapshotHash
+        cache = options.get("cache", True)
+        lazy = options.get("lazy", self.__lazyData)
+        pkg = self.__packages.get((hash, lazy)) if cache else None
+        if pkg is not None:
+            return pkg
 
-        result = self.__make_dfour_request(query, params)
+        if lazy:
+            pkg = self.__read_lazy_package(hash)
+        elif self.__httpCache:
+            data = self.__download_snapshot(hash)
+            pkg = Package(descriptor=data) if data is not None else None
+        else:
+            data = self.__query_snapshot(hash)
+            pkg = Package(descriptor=data) if data is not None else None
 
-        if result["snapshot"]:
-            pkg = Package(descriptor=result["snapshot"]["data"])
-            # for res in pkg.resources:
-            #     if res["mediatype"] == "application/geo+json":
+        if pkg is not None:
+            if cache:
+                self.__packages.set((hash, lazy), pkg)
             return pkg
 
-        note = (
-            f'Snapshot with hash "{self.__snapshotHash}" on {self.__url} doesn\'t exist'
-        )
+        note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
         raise FrictionlessException(errors.StorageError(note=note))
 
-    def read_resource(self, name):
-        pkg = self.read_package()
+    def read_packages(self, hashes, **options):
+        """Read several snapshots
+
+        Snapshots are fetched in batches of `config.BATCH_SIZE` aliased
+        fields per GraphQL request.
+
+        Parameters:
+            hashes (str[]): snapshot hashes
+
+        Yields:
+            Package: packages in the order of the hashes
+        """
+        for batch in protocol.batch_hashes(hashes):
+            query, params = protocol.batch_query(batch)
+
+            result = self.__make_dfour_request(query, params)
+
+            for hash, data in zip(batch, protocol.batch_data(batch, result)):
+                if data is None:
+                    note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
+                    raise FrictionlessException(errors.StorageError(note=note))
+                yield Package(descriptor=data)
+
+    def read_workspace_packages(self, **options):
+        """Read all snapshots of the workspace with a single request
+
+        Yields:
+            Package: packages in the order of the workspace
+        """
+        params = {"wshash": protocol.dfour_id(self.__workspaceHash, False)}
+
+        result = self.__make_dfour_request(protocol.WORKSPACE_PACKAGES, params)
+
+        if not result["workspace"]:
+            note = f'Workspace with hash "{self.__workspaceHash}" on {self.__url} doesn\'t exist'
+            raise FrictionlessException(errors.StorageError(note=note))
+        for snapshot in result["workspace"]["snapshots"] or []:
+            yield Package(descriptor=snapshot["data"])
+
+    def read_resource(self, name, **options):
+        pkg = self.read_package(**options)
         return pkg.get_resource(name)
 
+    def download_package(self, target, **options):
+        """Stream a snapshot into a file
+
+        The snapshot is parsed incrementally and written with the formatting
+        of `json.dump(package, file, indent=4)` without holding it in memory,
+        requires `ijson` ("frictionless-dfour[stream]"). The target is only
+        replaced once the download completed.
+
+        Parameters:
+            target (str): path of the JSON file to write
+            snapshotHash? (str): snapshot to download instead of the dialect's one
+
+        Returns:
+            dict: package metadata, resources without their inline data
+        """
+        hash = options.get("snapshotHash") or self.__snapshotHash
+        with helpers.open_atomic(target, encoding="utf-8") as file:
+            with self.__open_snapshot(hash) as (source, prefix):
+                found, metadata = helpers.stream_json(
+                    source, file, prefix=prefix, skip=["resources.item.data"]
+                )
+            if not found:
+                note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
+                raise FrictionlessException(errors.StorageError(note=note))
+        return metadata
+
+    def clear_cache(self, hash=None):
+        """Drop read snapshots from the cache
+
+        Parameters:
+            hash? (str): snapshot to drop, all snapshots if not given
+        """
+        if hash is None:
+            self.__packages.clear()
+        else:
+            self.__packages.pop((hash, False))
+            self.__packages.pop((hash, True))
+
     # Write
 
     def write_package(self, package, *, force, **options):
+        """Upload a package to the workspace
+
+        The snapshot is the `snapshotHash` of the dialect or the one titled
+        like the package, created if there's none. The data of lazy packages
+        is read from their files and uploaded inline.
+
+        Parameters:
+            package (Package): package to upload
+            index? (helpers.SnapshotIndex): title index shared by storages
+                uploading to the same workspace
+            progress? (func): called with bytes sent and total bytes
+        """
         if self.__workspaceHash and self.__username and self.__password:
             self.__dfour_login()
             if self.__sessionid:
-                # Check existing
                 if self.__snapshotHash:
                     pk = self.__snapshotHash
-                elif (
-                    not self.__snapshotHash
-                    and package.title in self.__workspaceSnapshots
-                ):
-                    # Snapshot already exists
-                    pk = [
-                        item["pk"]
-                        for item in list(self)
-                        if item["title"] == package.title
-                    ][0]
                 else:
-                    if self.__snapshotTopic and self.__bfsMuniciaplity:
-                        query = gql(
-                            """
-                            mutation updatesnapshot($data: SnapshotMutationInput!) {
-                                snapshotmutation(input: $data) {
-                                    snapshot {
-                                        pk
-                                    }
-                                }
-                            }
-                            """
-                        )
-
-                        params = {
-                            "data": {
-                                "title": package.title,
-                                "topic": self.__snapshotTopic,
-                                "bfsNumber": self.__bfsMuniciaplity,
-                                "wshash": self.__dfour_id(self.__workspaceHash),
-                            }
-                        }
-
-                        result = self.__make_dfour_request(
-                            query,
-                            params,
-                            self.__dfour_session.cookies,
-                            self.__dfour_session.headers,
-                        )
-
-                        if result["snapshotmutation"]["snapshot"]["pk"]:
-                            pk = result["snapshotmutation"]["snapshot"]["pk"]
-                    else:
-                        note = f'Uploading "{package.title}" on {self.__url} requires a municiaplity bfs number and a snapshot topic, set one via the DfourDialect.'
-                        raise FrictionlessException(errors.StorageError(note=note))
-                self.__upload_file(package, pk)
+                    index = options.get("index", self.__workspaceSnapshots)
+                    # Concurrent uploads of a new title must not create it twice
+                    with index.lock:
+                        pk = self.__resolve_snapshot(package, index)
+                self.__upload_file(package, pk, options.get("progress"))
+                self.clear_cache(pk)
             else:
                 note = f'Uploading "{package.title}" on {self.__url} requires valid login credentials.'
                 raise FrictionlessException(errors.StorageError(note=note))
@@ -265,89 +367,223 @@ class DfourStorage(Storage):
             note = f'Uploading "{package.title}" on {self.__url} needs a workspace hash and login credentials.'
             raise FrictionlessException(errors.StorageError(note=note))
 
+    def write_metadata(self, title, **options):
+        """Update the topic and municipality of an existing snapshot
+
+        Parameters:
+            title (str): snapshot title
+        """
+        if not (
+            self.__snapshotHash
+            and self.__workspaceHash
+            and self.__username
+            and self.__password
+        ):
+            note = f'Updating "{title}" on {self.__url} needs a snapshot hash, a workspace hash and login credentials.'
+            raise FrictionlessException(errors.StorageError(note=note))
+        if not (self.__snapshotTopic and self.__bfsMuniciaplity):
+            note = f'Updating "{title}" on {self.__url} requires a municiaplity bfs number and a snapshot topic, set one via the DfourDialect.'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+        self.__dfour_login()
+        if not self.__sessionid:
+            note = f'Updating "{title}" on {self.__url} requires valid login credentials.'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+        self.__mutate_snapshot(
+            protocol.snapshot_input(
+                self.__workspaceHash,
+                title,
+                self.__snapshotTopic,
+                self.__bfsMuniciaplity,
+                pk=self.__snapshotHash,
+            )
+        )
+        self.clear_cache(self.__snapshotHash)
+
     # helpers
 
-    def __make_dfour_request(self, query, params, cookies=None, headers=None):
-        transport = RequestsHTTPTransport(
-            url=self.__endpoint, headers=headers, cookies=cookies
+    def __mutate_snapshot(self, params):
+        # Sent on the login session, cookies of the response must not end up
+        # in the shared anonymous one
+        retry = True
+        while True:
+            try:
+                return client.execute_login(
+                    self.__dfour_session,
+                    self.__endpoint,
+                    protocol.SNAPSHOT_MUTATION,
+                    params,
+                    schema=self.__fetchSchema,
+                )
+            except (TransportQueryError, TransportServerError) as error:
+                # A reused session might have expired in the meantime
+                if retry and client.is_login_error(error):
+                    retry = False
+                    self.__dfour_login(rejected=self.__dfour_session)
+                    continue
+                title = params["data"]["title"]
+                note = f'Saving snapshot "{title}" on {self.__url} failed: {error}'
+                raise FrictionlessException(errors.StorageError(note=note))
+
+    def __query_snapshot(self, hash):
+        params = {"hash": protocol.dfour_id(hash)}
+
+        result = self.__make_dfour_request(protocol.SNAPSHOT, params)
+
+        if result["snapshot"]:
+            return result["snapshot"]["data"]
+
+    def __query_datafile(self, hash):
+        params = {"hash": protocol.dfour_id(hash)}
+
+        result = self.__make_dfour_request(protocol.SNAPSHOT_DATAFILE, params)
+
+        return result["snapshot"]
+
+    @contextmanager
+    def __open_snapshot(self, hash):
+        # Yields the snapshot as a binary stream and the ijson prefix of its data
+        snapshot = self.__query_datafile(hash) if self.__httpCache else None
+        if snapshot and snapshot["datafile"]:
+            path = self.__download_datafile(hash, snapshot["datafile"])
+            with open(path, "rb") as source:
+                yield source, ""
+        elif snapshot is not None or not self.__httpCache:
+            params = {"hash": protocol.dfour_id(hash)}
+
+            with client.execute_stream(
+                self.__endpoint, protocol.SNAPSHOT, params
+            ) as response:
+                yield response.raw, "data.snapshot.data"
+        else:
+            note = f'Snapshot with hash "{hash}" on {self.__url} doesn\'t exist'
+            raise FrictionlessException(errors.StorageError(note=note))
+
+    def __read_lazy_package(self, hash):
+        basepath = tempfile.mkdtemp(prefix=config.LAZY_PREFIX)
+        try:
+            with self.__open_snapshot(hash) as (source, prefix):
+                found, data = helpers.spill_resources(source, basepath, prefix=prefix)
+        except Exception:
+            shutil.rmtree(basepath, ignore_errors=True)
+            raise
+        if not found:
+            shutil.rmtree(basepath, ignore_errors=True)
+            return None
+        self.__tempdirs.append(basepath)
+        return Package(descriptor=data, basepath=basepath)
+
+    def __download_snapshot(self, hash):
+        snapshot = self.__query_datafile(hash)
+
+        if not snapshot:
+            return None
+        if not snapshot["datafile"]:
+            # Snapshots without an uploaded file only exist in the database
+            return self.__query_snapshot(hash)
+
+        path = self.__download_datafile(hash, snapshot["datafile"])
+        return helpers.load_json(path)
+
+    def __download_datafile(self, hash, datafile):
+        return client.download(
+            protocol.datafile_url(self.__url, datafile),
+            key=protocol.datafile_key(self.__url, hash),
         )
-        client = Client(
-            transport=transport,
-            fetch_schema_from_transport=True,
+
+    def __make_dfour_request(self, query, params):
+        return client.execute(
+            self.__endpoint, query, params, schema=self.__fetchSchema
         )
-        return client.execute(query, variable_values=params)
 
-    def __upload_file(self, package, pk):
-        uploadUrl = f"{self.__url}/api/v1/snapshots/{pk}/"
+    def __upload_file(self, package, pk, progress=None):
+        uploadUrl = protocol.upload_url(self.__url, pk)
+        filename = protocol.upload_filename(pk, package)
+        retry = protocol.UploadRetry(self.__url, self.__compression)
 
-        files = [
-            (
-                "data_file",
-                (f"{pk}-{package.name}.json", json.dumps(package), "application/json"),
+        # Uploads are encoded with orjson if it's installed
+        spool = helpers.spool_json(
+            helpers.inline_lazy_data(package), separators=(",", ":"), fast=True
+        )
+        with spool as file:
+            body = client.MultipartFile(
+                "data_file", filename, file, encoding=retry.encoding, progress=progress
             )
-        ]
-        headers = {
-            "X-CSRFToken": self.__get_token(),  # CORS-Token from above
-        }
+            while True:
+                headers = {
+                    "X-CSRFToken": self.__get_token(),  # CORS-Token from above
+                    **body.headers,
+                }
 
-        self.__dfour_session.request(
-            "PATCH", uploadUrl, headers=headers, files=files
-        )  # submit the PATCH request
-        # note = f'upload failed. {r.text}'
-        # raise FrictionlessException(errors.StorageError(note=note))
+                with tracing.span("upload", url=uploadUrl) as span:
+                    response = self.__dfour_session.request(
+                        "PATCH", uploadUrl, headers=headers, data=body
+                    )  # submit the PATCH request
+                    span.bytes = len(body)
+                    span.status = response.status_code
+
+                action = retry.check(response.status_code, response.url)
+                if action == retry.LOGIN:
+                    self.__dfour_login(rejected=self.__dfour_session)
+                    continue
+                if action == retry.UNCOMPRESS:
+                    body.close()
+                    body = client.MultipartFile(
+                        "data_file", filename, file, progress=progress
+                    )
+                    continue
+                break
+            body.close()
+
+        if not response.ok:
+            note = f'Uploading "{package.title}" on {self.__url} failed: {response.status_code} {response.text[:200]}'
+            raise FrictionlessException(errors.StorageError(note=note))
 
     # Internal
 
+    def __get_workspace_snapshots(self, index):
+        if not index.loaded:
+            for item in self:
+                index.setdefault(item["title"], item["pk"])
+            index.loaded = True
+        return index
+
+    def __resolve_snapshot(self, package, index):
+        if package.title in self.__get_workspace_snapshots(index):
+            return index[package.title]
+        elif self.__snapshotTopic and self.__bfsMuniciaplity:
+            result = self.__mutate_snapshot(
+                protocol.snapshot_input(
+                    self.__workspaceHash,
+                    package.title,
+                    self.__snapshotTopic,
+                    self.__bfsMuniciaplity,
+                )
+            )
+            pk = result["snapshotmutation"]["snapshot"]["pk"]
+            index[package.title] = pk
+            return pk
+        else:
+            note = f'Uploading "{package.title}" on {self.__url} requires a municiaplity bfs number and a snapshot topic, set one via the DfourDialect.'
+            raise FrictionlessException(errors.StorageError(note=note))
+
     def __get_token(self):
         return self.__dfour_session.cookies["csrftoken"]
 
-    def __dfour_id(self, hash, snapshot=True):
-        if snapshot:
-            prefix = "SnapshotNode"
-        else:
-            prefix = "WorkspaceNode"
-        return base64.b64encode(f"{prefix}:{hash}".encode("ascii")).decode("ascii")
-
-    def __dfour_session(self):
-        self.__dfour_session = requests.session()
-
-    def __dfour_login(self):
-        self.__dfour_session()
-        self.__dfour_session.get(f"{self.__url}/account/login/")
-        if self.__username and self.__password and self.__get_token():
-            if self.__username.startswith("env:"):
-                username = os.environ.get(self.__username[4:])
-            else:
-                username = self.__username
+    def __dfour_login(self, rejected=None):
+        username, password = protocol.get_credentials(self.__username, self.__password)
 
-            if self.__password.startswith("env:"):
-                password = os.environ.get(self.__password[4:])
-            else:
-                password = self.__password
-
-            headers = {
-                "Cookie": "; ".join(
-                    [f"csrftoken={self.__get_token()}"]
-                ),  # make sure the CORS-Token cookie is set
-                "Content-Type": "application/x-www-form-urlencoded",  # set the Content Type to form-urlencoded
-                "Referer": f"{self.__url}/account/login/",
-            }
-            payload = {
-                "csrfmiddlewaretoken": self.__get_token(),  # set the the CORS-Token
-                "username": username,
-                "password": password,
-            }
-
-            payload = urllib.parse.urlencode(
-                payload
-            )  # encode payload as www-form-urlencoded
-
-            self.__dfour_session.post(
-                f"{self.__url}/account/login/", data=payload, headers=headers
-            )
+        self.__dfour_session = client.get_login(
+            self.__url,
+            username,
+            password,
+            rejected=rejected,
+            persist=self.__persistSession,
+        )
 
-            if "sessionid" in self.__dfour_session.cookies.keys():
-                self.__sessionid = self.__dfour_session.cookies["sessionid"]
-            else:
-                note = f"Couldn't obtain {self.__url} session. Current cookies: {self.__dfour_session.cookies}, {self.__get_token()} {username} {password}"
-                raise FrictionlessException(errors.StorageError(note=note))
+        if "sessionid" in self.__dfour_session.cookies.keys():
+            self.__sessionid = self.__dfour_session.cookies["sessionid"]
+        else:
+            note = f"Couldn't obtain {self.__url} session for {username}. Current cookies: {self.__dfour_session.cookies.keys()}"
+            raise FrictionlessException(errors.StorageError(note=note))
@@ -0,0 +1,609 @@
+import os
+import gc
+import json
+import zlib
+import shutil
+import hashlib
+import tempfile
+import threading
+import importlib.util
+from decimal import Decimal
+from collections import OrderedDict
+from contextlib import contextmanager
+from . import config
+from . import tracing
+
+
+# Files
+
+
+def cache_path(*paths):
+    """Path inside the frictionless-dfour cache directory
+
+    The directory is taken from `DFOUR_CACHE_DIR`, `XDG_CACHE_HOME` or
+    `~/.cache` (in that order) and created on demand.
+    """
+    basedir = os.environ.get("DFOUR_CACHE_DIR")
+    if not basedir:
+        basedir = os.path.join(
+            os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+            config.CACHE_NAME,
+        )
+    path = os.path.join(basedir, *paths)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def write_atomic(path, text, *, mode=None):
+    """Write text to a file via a temporary file and a rename
+
+    The file keeps its current permissions unless `mode` is given.
+    """
+    with open_atomic(path, mode=mode) as file:
+        file.write(text)
+
+
+@contextmanager
+def open_atomic(path, *, mode=None, encoding=None):
+    """Open a temporary text file replacing `path` once it's closed
+
+    The file isn't replaced if the block raises. It keeps its current
+    permissions unless `mode` is given.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    if mode is None:
+        mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+    fd, temp = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as file:
+            yield file
+        os.chmod(temp, mode)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+# Modules
+
+
+def is_installed(name):
+    """Whether an optional module can be imported"""
+    return importlib.util.find_spec(name) is not None
+
+
+# Caching
+
+
+class LRUCache:
+    """Thread-safe mapping keeping the most recently used items
+
+    Parameters:
+        maxsize? (int): number of items to keep, None for no limit and 0 to disable
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__items
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__items)
+
+    def get(self, key, default=None):
+        with self.__lock:
+            if key not in self.__items:
+                return default
+            self.__items.move_to_end(key)
+            return self.__items[key]
+
+    def set(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self.__items) > self.maxsize:
+                    self.__items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            return self.__items.pop(key, default)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+
+class SnapshotIndex(dict):
+    """Title to pk mapping of the snapshots in a dfour workspace
+
+    Storages uploading to the same workspace can share an index (see the
+    `index` option of `DfourStorage.write_package`) so the workspace is
+    listed once and a new title is created once. Hold `lock` while reading
+    or changing it, `loaded` tells whether the workspace was listed yet.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.RLock()
+        self.loaded = False
+
+
+# Json
+
+
+def iter_json(obj, *, depth=config.JSON_DEPTH, fast=False, **options):
+    """Encode an object to JSON in chunks
+
+    The output is the same as `json.dumps(obj, **options)` but produced
+    piece by piece: containers are walked `depth` levels deep and everything
+    below is encoded at once by the (fast) stdlib encoder. The default depth
+    splits inline GeoJSON resources of a data package per feature.
+
+    With `fast` everything below is encoded by orjson if it's available (see
+    `import_orjson`). The output is the same JSON value but not the same
+    bytes: non-ASCII characters aren't escaped and floats are formatted
+    differently, so it's only meant for uploads and not for hashing. orjson
+    writes NaN and infinities as null, chunks with a null are encoded by the
+    stdlib to keep them.
+
+    Parameters:
+        obj (any): object to encode
+        depth? (int): number of container levels to split
+        fast? (bool): encode with orjson, needs compact `separators`
+        **options: `json.dumps` options except `indent`
+
+    Yields:
+        str: JSON chunks
+    """
+    assert options.get("indent") is None, "indented output isn't supported"
+    item_separator, key_separator = options.get("separators") or (", ", ": ")
+    encode = json.JSONEncoder(**options).encode
+    orjson = import_orjson() if fast else None
+    if orjson is not None:
+        assert (item_separator, key_separator) == (",", ":"), "needs compact output"
+        encode = create_fast_encoder(orjson, encode, options)
+    sort_keys = options.get("sort_keys", False)
+
+    def iterate(obj, depth):
+        # Metadata classes like Resource override `__iter__` so dicts are
+        # accessed the way the stdlib encoder does
+        if (
+            depth
+            and isinstance(obj, dict)
+            and obj
+            and all(isinstance(key, str) for key in dict.keys(obj))
+        ):
+            yield "{"
+            items = dict.items(obj)
+            items = sorted(items) if sort_keys else items
+            for index, (key, value) in enumerate(items):
+                yield (item_separator if index else "") + encode(key) + key_separator
+                yield from iterate(value, depth - 1)
+            yield "}"
+        elif depth == 1 and isinstance(obj, (list, tuple)) and obj:
+            # Items encoded at once are grouped to save encoder calls
+            yield "["
+            for start in range(0, len(obj), config.JSON_BATCH):
+                if start:
+                    yield item_separator
+                yield encode(list(obj[start : start + config.JSON_BATCH]))[1:-1]
+            yield "]"
+        elif depth and isinstance(obj, (list, tuple)) and obj:
+            yield "["
+            for index, item in enumerate(obj):
+                if index:
+                    yield item_separator
+                yield from iterate(item, depth - 1)
+            yield "]"
+        else:
+            yield encode(obj)
+
+    return iterate(obj, depth)
+
+
+def hash_json(obj, *, algorithm=None):
+    """Hash the canonical JSON encoding of an object
+
+    The encoding is the one of `json.dumps(obj, separators=(",", ":"),
+    sort_keys=True)` streamed into the hash in `config.CHUNK_SIZE` blocks
+    instead of being built in memory.
+
+    Parameters:
+        obj (any): object to hash
+        algorithm? (str): hashlib algorithm, `config.HASH_ALGORITHM` by default
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.new(algorithm or config.HASH_ALGORITHM)
+    with tracing.span("hash", algorithm=digest.name) as span:
+        span.bytes = 0
+        buffer = []
+        size = 0
+        for chunk in iter_json(obj, separators=(",", ":"), sort_keys=True):
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= config.CHUNK_SIZE:
+                span.bytes += size
+                digest.update("".join(buffer).encode("utf-8"))
+                buffer = []
+                size = 0
+        span.bytes += size
+        digest.update("".join(buffer).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def create_fast_encoder(orjson, fallback, options):
+    option = orjson.OPT_SORT_KEYS if options.get("sort_keys") else 0
+
+    def encode(obj):
+        try:
+            text = orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError:
+            # e.g. integers beyond 64 bits or non-string keys
+            return fallback(obj)
+        # A null might have been NaN or an infinity, which the stdlib keeps
+        if "null" in text:
+            return fallback(obj)
+        return text
+
+    return encode
+
+
+# Digits are mapped to "0" and everything else to " " to find long numbers
+DIGITS = bytes(48 if 48 <= byte <= 57 else 32 for byte in range(256))
+LONG_DIGITS = b"0" * 19
+
+
+def loads_json(text, *, pause_gc=False):
+    """Parse a JSON document with the fastest available parser
+
+    orjson is used if it's available (see `import_orjson`). Documents it
+    rejects e.g. with NaN or lone surrogates, and documents with integers
+    beyond 64 bits, are parsed by the stdlib, so the result is always the
+    one of `json.loads`.
+
+    Parsing can't create reference cycles, but the garbage collector walks
+    the growing document over and over, which triples the time orjson
+    takes on large documents. Applications owning the process can pause it
+    meanwhile with `pause_gc`, it's process-wide so libraries shouldn't.
+
+    Parameters:
+        text (str|bytes): JSON document
+        pause_gc? (bool): disable the garbage collector while parsing
+
+    Returns:
+        any: parsed value
+    """
+    orjson = import_orjson()
+    data = text.encode("utf-8", "surrogatepass") if isinstance(text, str) else text
+    enabled = pause_gc and gc.isenabled()
+    if enabled:
+        gc.disable()
+    try:
+        # orjson turns integers beyond 64 bits into floats, long digit runs
+        # are rare enough to leave these documents to the stdlib
+        if orjson is not None and not has_long_digits(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(text)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def has_long_digits(data):
+    """Whether bytes contain a run of `LONG_DIGITS` or more digits
+
+    The bytes are scanned in `config.CHUNK_SIZE` blocks overlapping by a
+    run, so only one block is copied at a time.
+    """
+    overlap = len(LONG_DIGITS) - 1
+    for start in range(0, len(data), config.CHUNK_SIZE):
+        block = data[start : start + config.CHUNK_SIZE + overlap]
+        if LONG_DIGITS in block.translate(DIGITS):
+            return True
+    return False
+
+
+def load_json(path, **options):
+    """Parse a JSON file with the fastest available parser, see `loads_json`"""
+    with open(path, "rb") as file:
+        return loads_json(file.read(), **options)
+
+
+def spool_json(obj, **options):
+    """Encode an object to JSON into a spooled temporary file
+
+    Up to `config.SPOOL_SIZE` bytes are kept in memory, larger documents
+    are moved to disk. The file is rewound before it's returned.
+
+    Parameters:
+        obj (any): object to encode
+        **options: `iter_json` options
+
+    Returns:
+        SpooledTemporaryFile: binary file with the UTF-8 encoded JSON
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=config.SPOOL_SIZE)
+    with tracing.span("serialize") as span:
+        for chunk in iter_json(obj, **options):
+            file.write(chunk.encode("utf-8"))
+        span.bytes = file.tell()
+    file.seek(0)
+    return file
+
+
+def stream_json(source, file, *, prefix="", skip=(), indent=4):
+    """Copy a JSON value from a stream to a file with bounded memory
+
+    The value at `prefix` (an ijson prefix e.g. "data.snapshot.data") is
+    parsed incrementally and written with the same formatting as
+    `json.dump(value, file, indent=indent)`. Only the parts of the value
+    outside of the `skip` prefixes (relative to the value e.g.
+    "resources.item.data") are kept in memory and returned.
+
+    Parameters:
+        source (file): binary file-like object with a JSON document
+        file (file): text file to write the value to
+        prefix? (str): prefix of the value to copy, the whole document by default
+        skip? (str[]): prefixes of parts of the value not to keep in memory
+        indent? (int): indentation of the written value
+
+    Returns:
+        (bool, any): whether the value was found and the kept parts of it
+    """
+    ijson = import_ijson()
+    skip = [join_prefix(prefix, path) for path in skip]
+    builder = ijson.ObjectBuilder()
+    writer = JsonWriter(file, indent=indent)
+    found = False
+
+    for path, event, value in parse_json_events(ijson, source):
+        if prefix and not is_prefix(prefix, path):
+            continue
+        found = True
+        if not is_skipped(skip, path, event, value):
+            builder.event(event, value)
+        writer.event(event, value)
+
+    return found, builder.value if found else None
+
+
+def spill_resources(source, basepath, *, prefix=""):
+    """Read a data package from a stream moving inline data to files
+
+    The inline `data` of every resource is written unparsed to a file in
+    `basepath` and replaced by its `path`. Objects e.g. GeoJSON are written
+    to ".geojson" files and arrays to ".json" files, so
+    `resource.read_data()` and `resource.read_rows()` still work.
+
+    Parameters:
+        source (file): binary file-like object with a JSON document
+        basepath (str): directory to write the data files to
+        prefix? (str): prefix of the package, the whole document by default
+
+    Returns:
+        (bool, dict): whether the package was found and its descriptor
+    """
+    ijson = import_ijson()
+    resource = join_prefix(prefix, "resources.item")
+    data = f"{resource}.data"
+    builder = ijson.ObjectBuilder()
+    found = False
+    index = -1
+    paths = {}
+    file = writer = None
+
+    for path, event, value in parse_json_events(ijson, source):
+        if prefix and not is_prefix(prefix, path):
+            continue
+        found = True
+        if path == resource and event == "start_map":
+            index += 1
+        if not is_prefix(data, path):
+            if not (path == resource and event == "map_key" and value == "data"):
+                builder.event(event, value)
+            continue
+
+        # Inline data of the current resource
+        if writer is None:
+            extension = {"start_map": "geojson", "start_array": "json"}
+            paths[index] = f"resource-{index}.{extension.get(event, 'txt')}"
+            file = open(os.path.join(basepath, paths[index]), "w", encoding="utf-8")
+            writer = JsonWriter(file)
+        writer.event(event, value)
+        if writer.closed:
+            file.close()
+            file = writer = None
+
+    if not found:
+        return False, None
+    descriptor = builder.value
+    for index, path in paths.items():
+        descriptor["resources"][index]["path"] = path
+    return True, descriptor
+
+
+def inline_lazy_data(package):
+    """Package with the data of lazy resources inlined again
+
+    Lazy packages (see `spill_resources`) keep the inline data of their
+    resources in files of a `config.LAZY_PREFIX` temporary directory. The
+    `path` of these resources is replaced by the data of the file, other
+    packages are returned as they are.
+
+    Returns:
+        Package|dict: package or descriptor
+    """
+    resources = enumerate(package.resources)
+    lazy = [index for index, resource in resources if is_lazy(resource)]
+    if not lazy:
+        return package
+    descriptor = package.to_dict()
+    for index in lazy:
+        resource = descriptor["resources"][index]
+        resource.pop("path")
+        resource["data"] = load_json(package.resources[index].fullpath)
+    return descriptor
+
+
+def is_lazy(resource):
+    """Whether a resource keeps its data in a file of a lazy package"""
+    basepath = resource.basepath
+    return bool(
+        isinstance(resource.path, str)
+        and basepath
+        and os.path.basename(os.path.normpath(basepath)).startswith(config.LAZY_PREFIX)
+    )
+
+
+def remove_dirs(paths):
+    """Remove directories and empty the list of their paths"""
+    while paths:
+        shutil.rmtree(paths.pop(), ignore_errors=True)
+
+
+def parse_json_events(ijson, source):
+    """ijson events of a JSON document with numbers parsed like `json.load`
+
+    ijson's `use_float` fails on integers wider than 64 bits, so numbers are
+    parsed exactly and decimals converted to floats.
+    """
+    for path, event, value in ijson.parse(source):
+        if value.__class__ is Decimal:
+            value = float(value)
+        yield path, event, value
+
+
+class JsonWriter:
+    """Write ijson events as JSON formatted the way `json.dump` does
+
+    Parameters:
+        file (file): text file to write to
+        indent? (int): indentation, compact `json.dumps` output by default
+    """
+
+    def __init__(self, file, *, indent=None):
+        self.file = file
+        self.indent = indent
+        self.closed = False
+        self.__stack = []  # [kind, count] of the open containers
+
+    def event(self, event, value):
+        stack = self.__stack
+        if event == "map_key":
+            self.__separate()
+            self.file.write(f"{json.dumps(value)}: ")
+            return
+        if event in ("end_map", "end_array"):
+            kind, count = stack.pop()
+            if count and self.indent is not None:
+                self.file.write("\n" + " " * self.indent * len(stack))
+            self.file.write("}" if event == "end_map" else "]")
+        else:
+            if stack and stack[-1][0] == "array":
+                self.__separate()
+            if event == "start_map":
+                self.file.write("{")
+                stack.append(["map", 0])
+            elif event == "start_array":
+                self.file.write("[")
+                stack.append(["array", 0])
+            else:
+                self.file.write(json.dumps(value))
+        self.closed = not stack
+
+    def __separate(self):
+        stack = self.__stack
+        if self.indent is not None:
+            separator = "," if stack[-1][1] else ""
+            self.file.write(f"{separator}\n" + " " * self.indent * len(stack))
+        elif stack[-1][1]:
+            self.file.write(", ")
+        stack[-1][1] += 1
+
+
+def join_prefix(prefix, path):
+    return f"{prefix}.{path}" if prefix else path
+
+
+def is_prefix(prefix, path):
+    return path == prefix or path.startswith(f"{prefix}.")
+
+
+def is_skipped(skip, path, event, value):
+    if event == "map_key":
+        path = join_prefix(path, value)
+    return any(is_prefix(item, path) for item in skip)
+
+
+def import_ijson():
+    try:
+        import ijson
+    except ImportError:
+        from frictionless import errors
+        from frictionless.exception import FrictionlessException
+
+        note = 'Streaming downloads require "ijson", install "frictionless-dfour[stream]"'
+        raise FrictionlessException(errors.StorageError(note=note))
+    return ijson
+
+
+def import_orjson():
+    """orjson module, None if it's not installed or disabled
+
+    `config.JSON_BACKEND` (`DFOUR_JSON_BACKEND`) picks the JSON library:
+    "auto" uses orjson if it's installed, "json" always the stdlib and
+    "orjson" fails without it.
+    """
+    if config.JSON_BACKEND == "json":
+        return None
+    try:
+        import orjson
+    except ImportError:
+        if config.JSON_BACKEND == "orjson":
+            from frictionless import errors
+            from frictionless.exception import FrictionlessException
+
+            note = 'The "orjson" backend requires "orjson", install "frictionless-dfour[fast]"'
+            raise FrictionlessException(errors.StorageError(note=note))
+        return None
+    return orjson
+
+
+# Compression
+
+
+def create_compressor(encoding):
+    """Create a streaming compressor for a content encoding
+
+    Parameters:
+        encoding (str): "gzip" or "zstd" (requires the `zstandard` package)
+
+    Returns:
+        object: compressor with `compress(data)` and `flush()`
+    """
+    if encoding == "gzip":
+        return zlib.compressobj(wbits=31)
+    if encoding == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            from frictionless import errors
+            from frictionless.exception import FrictionlessException
+
+            note = 'Compression "zstd" requires "zstandard", install "frictionless-dfour[zstd]"'
+            raise FrictionlessException(errors.StorageError(note=note))
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f'Unsupported compression "{encoding}"')
@@ -0,0 +1,30 @@
+from frictionless import Plugin
+
+
+# Plugin
+
+
+class DfourPlugin(Plugin):
+    """Plugin for dfour
+    API      | Usage
+    -------- | --------
+    Public   | `from frictionless_dfour import DfourPlugin`
+    """
+
+    code = "dfour"
+    status = "experimental"
+
+    # The storage is imported on first use, so discovering the plugin
+    # doesn't import gql and requests
+
+    def create_dialect(self, resource, *, descriptor):
+        if resource.format == "dfour":
+            from .dfour import DfourDialect
+
+            return DfourDialect(descriptor)
+
+    def create_storage(self, name, source, **options):
+        if name == "dfour":
+            from .dfour import DfourStorage
+
+            return DfourStorage(source, **options)
@@ -41,6 +41,46 @@ dry = Option(
 
 noninteractive = Option(False, "-y", help="run without prompts")
 
+schema = Option(
+    True,
+    help="validate queries against the (cached) dfour schema",
+)
+
+persist_session = Option(
+    False,
+    help="keep the dfour login session on disk across runs",
+)
+
+compression = Option(
+    None,
+    help="compress uploads with gzip or zstd",
+)
+
+http_cache = Option(
+    False,
+    help="download snapshots through the on-disk HTTP cache",
+)
+
+jobs = Option(
+    1,
+    "--jobs",
+    "-j",
+    min=1,
+    help="number of changes to apply concurrently",
+)
+
+scan_jobs = Option(
+    1,
+    "--scan-jobs",
+    min=1,
+    help="number of processes parsing and hashing local files",
+)
+
+profile = Option(
+    False,
+    help="print the time spent per phase and request type",
+)
+
 credentials = Option(
     None,
     "--credentials",
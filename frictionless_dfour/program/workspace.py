@@ -1,27 +1,26 @@
 import os
 import json as js
-import yaml as ym
-from dictdiffer import diff
-from slugify import slugify
 import hashlib
 import typer
 import datetime
 import time
-import pytz
-from tzlocal import get_localzone
-import requests
 import pathlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from . import common
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 import base64
-from frictionless import Package, system
-from ..dfour import DfourDialect
+from .. import config
+from .. import helpers
+from .. import tracing
 from .main import program
 
+# frictionless, gql, requests, yaml, slugify and the timezone libraries are
+# imported by the functions using them, so `dfour --help` starts quickly
+
 workspace = typer.Typer()
-gmt = pytz.timezone("GMT")  # server timezone -> should be inferred from request
-local_tz = get_localzone()  # current systems timezone
+
+LOCAL_STATE_VERSION = 1
 
 # Classes
 
@@ -47,6 +46,13 @@ def program_workspace(
     username: str = common.username,
     password: str = common.password,
     endpoint: str = common.endpoint,
+    schema: bool = common.schema,
+    persist_session: bool = common.persist_session,
+    compression: str = common.compression,
+    http_cache: bool = common.http_cache,
+    jobs: int = common.jobs,
+    scan_jobs: int = common.scan_jobs,
+    profile: bool = common.profile,
     # yaml: bool = common.yaml,
     # json: bool = common.json,
     # csv: bool = common.csv,
@@ -55,231 +61,326 @@ def program_workspace(
     Show workspace overview.
     """
 
-    credentials = dict(
-        username=username if username is not None else os.getenv("DFOUR_USERNAME"),
-        password=password if password is not None else os.getenv("DFOUR_PASSWORD"),
-    )
+    profiler = tracing.Profile() if profile else None
+    if profiler:
+        tracing.add_hook(profiler)
+    try:
+        credentials = dict(
+            username=username if username is not None else os.getenv("DFOUR_USERNAME"),
+            password=password if password is not None else os.getenv("DFOUR_PASSWORD"),
+            persistSession=persist_session,
+            compression=compression,
+            httpCache=http_cache,
+        )
 
-    endpoint = endpoint if endpoint is not None else os.getenv("DFOUR_ENDPOINT")
+        endpoint = endpoint if endpoint is not None else os.getenv("DFOUR_ENDPOINT")
 
-    if os.path.exists(f"{folder}/dfour.yaml"):
-        with open(f"{folder}/dfour.yaml") as config_file:
-            ws_config = ym.safe_load(config_file)
-        config_data = ws_config
+        if os.path.exists(f"{folder}/dfour.yaml"):
+            config_data = read_config(folder)
 
-    else:
-        config_data = {}
-        config_data[workspace] = dict(endpoint=endpoint, snapshots={})
+        else:
+            config_data = {}
+            config_data[workspace] = dict(endpoint=endpoint, snapshots={})
 
-        typer.secho(f"Found no dfour.yaml in {folder}.")
+            typer.secho(f"Found no dfour.yaml in {folder}.")
 
-        if not noninteractive:
-            typer.confirm(f"Create {folder}/dfour.yaml?", abort=True)
+            if not noninteractive:
+                typer.confirm(f"Create {folder}/dfour.yaml?", abort=True)
 
-        with open(f"{folder}/dfour.yaml", "w") as config_file:
-            ym.dump(config_data, config_file)
+            write_config(folder, config_data)
 
-    endpoint = (
-        config_data[workspace]["endpoint"]
-        if "endpoint" in config_data[workspace].keys()
-        else endpoint
-    )
+        endpoint = (
+            config_data[workspace]["endpoint"]
+            if "endpoint" in config_data[workspace].keys()
+            else endpoint
+        )
+
+        with tracing.span("local"):
+            local_data = get_local_data(
+                folder, config_data, workspace, noninteractive, jobs=scan_jobs
+            )
+        with tracing.span("remote", url=endpoint):
+            remote_data = get_remote_data(
+                endpoint, workspace, schema=schema, http_cache=http_cache
+            )
 
-    local_data = get_local_data(folder, config_data, workspace, noninteractive)
-    remote_data = get_remote_data(endpoint, workspace)
+        merged = set(local_data["snapshots"]) | set(remote_data["snapshots"])
+        with tracing.span("plan"):
+            changes = plan_changes(folder, local_data, remote_data)
+
+        # snaps = compile_snapshots(endpoint, workspace, data,folder)
+
+        if len(changes) > 0:  # not yaml and not json and not csv and
+            typer.secho(f"{len(merged)} snapshot(s) found. Changes:")
+            typer.secho(js.dumps(changes, cls=DateTimeEncoder, indent=4))
+
+        if len(changes) > 0 and not dry:
+            if not noninteractive:
+                typer.confirm("Do you want to apply these changes?", abort=True)
+            typer.secho("Processing")
+
+            with tracing.span("apply"):
+                failed = process_changes(
+                    changes,
+                    folder,
+                    endpoint,
+                    workspace,
+                    credentials,
+                    schema=schema,
+                    jobs=jobs,
+                    config_data=config_data,
+                )
+            if failed:
+                typer.secho(
+                    f"{len(changes) - len(failed)} change(s) applied, {len(failed)} failed.",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+                update_local_state(folder, local_data, remote_data)
+                raise typer.Exit(1)
+        else:
+            typer.secho(f"\n{len(merged)} snapshot(s) found. No changes detected.\n")
 
-    merged = local_data["snapshots"].copy()
-    merged.update(remote_data["snapshots"])
-    data_diff = diff(remote_data["snapshots"], local_data["snapshots"])
+        update_local_state(folder, local_data, remote_data)
 
-    changes = []
-    for v in data_diff:
-        change_type = v[0]
-        key = v[1]
-        change = v[2]
-
-        # TODO: handle metadata updates of `topic` and `bfsNumber`
-
-        if key.endswith("hash") or change_type == "add" or change_type == "remove":
-            if key.endswith("hash"):
-                snap_name = key.split(".")[0]
-                path = local_data["snapshots"][snap_name]["datafile"]
-                snap_hash = remote_data["snapshots"][snap_name]["pk"]
-
-                local_date = local_data["snapshots"][snap_name]["last_modified"]
-                remote_date = remote_data["snapshots"][snap_name]["last_modified"]
-
-                if local_date < remote_date:
-                    options = dict(
-                        type="download-replace",
-                        source=snap_hash,
-                        target=path,
-                        topic=remote_data["snapshots"][snap_name]["topic"],
-                        bfsNumber=remote_data["snapshots"][snap_name]["bfsNumber"],
-                    )
+    finally:
+        if profiler:
+            tracing.remove_hook(profiler)
+            typer.secho(profiler.summary(), err=True)
 
-                elif local_date > remote_date:
-                    options = dict(
-                        type="upload-replace",
-                        source=path,
-                        target=snap_hash,
-                        topic=local_data["snapshots"][snap_name]["topic"],
-                        bfsNumber=local_data["snapshots"][snap_name]["bfsNumber"],
-                    )
+# Helpers
 
-                if options:
-                    to_apply = {
-                        "name": snap_name,
-                        **options,
-                        "local_date": local_date,
-                        "remote_date": remote_date,
-                    }
-                    changes.append(to_apply)
-            else:
-                change_type = "download" if change_type == "remove" else "upload"
-
-                for sub in change:
-                    snap_name = sub[0]
-                    path = f"{folder}/{snap_name}.json"
-                    snap_hash = (
-                        remote_data["snapshots"][snap_name]["pk"]
-                        if change_type == "download"
-                        else None
-                    )
 
-                    local_date = (
-                        local_data["snapshots"][snap_name]["last_modified"]
-                        if snap_name in local_data["snapshots"]
-                        else None
-                    )
-                    remote_date = (
-                        remote_data["snapshots"][snap_name]["last_modified"]
-                        if snap_name in remote_data["snapshots"]
-                        else None
-                    )
+def plan_changes(folder, local_data, remote_data):
+    # One pass over all snapshot names, changes are one of
+    # download, download-replace, upload, upload-replace and update
+    changes = []
+    local_snaps = local_data["snapshots"]
+    remote_snaps = remote_data["snapshots"]
+
+    for name in sorted(set(local_snaps) | set(remote_snaps)):
+        local = local_snaps.get(name)
+        remote = remote_snaps.get(name)
+        local_date = local["last_modified"] if local else None
+        remote_date = remote["last_modified"] if remote else None
+
+        if not local:
+            change = dict(
+                type="download",
+                source=remote["pk"],
+                target=f"{folder}/{name}.json",
+                topic=remote["topic"],
+                bfsNumber=remote["bfsNumber"],
+            )
+        elif not remote:
+            change = dict(
+                type="upload",
+                source=local["datafile"],
+                target="",
+                topic=local["topic"],
+                bfsNumber=local["bfsNumber"],
+            )
+        elif local["hash"] != remote["hash"] and local_date < remote_date:
+            change = dict(
+                type="download-replace",
+                source=remote["pk"],
+                target=local["datafile"],
+                topic=remote["topic"],
+                bfsNumber=remote["bfsNumber"],
+            )
+        elif local["hash"] != remote["hash"] and local_date > remote_date:
+            change = dict(
+                type="upload-replace",
+                source=local["datafile"],
+                target=remote["pk"],
+                topic=local["topic"],
+                bfsNumber=local["bfsNumber"],
+            )
+        else:
+            change = None
 
-                    if change_type == "download":
-                        options = dict(
-                            type=change_type,
-                            source=snap_hash,
-                            target=path,
-                            topic=remote_data["snapshots"][snap_name]["topic"],
-                            bfsNumber=remote_data["snapshots"][snap_name]["bfsNumber"],
-                        )
-                    elif change_type == "upload":
-                        options = dict(
-                            type=change_type,
-                            source=local_data["snapshots"][snap_name]["datafile"],
-                            target="",
-                            topic=local_data["snapshots"][snap_name]["topic"],
-                            bfsNumber=local_data["snapshots"][snap_name]["bfsNumber"],
-                        )
-
-                    to_apply = {
-                        "name": snap_name,
-                        **options,
-                        "local_date": local_date,
-                        "remote_date": remote_date,
-                    }
-                    changes.append(to_apply)
-
-    # snaps = compile_snapshots(endpoint, workspace, data,folder)
-
-    if len(changes) > 0:  # not yaml and not json and not csv and
-        typer.secho(f"{len(merged)} snapshot(s) found. Changes:")
-        typer.secho(js.dumps(changes, cls=DateTimeEncoder, indent=4))
-
-    if len(changes) > 0 and not dry:
-        if not noninteractive:
-            typer.confirm("Do you want to apply these changes?", abort=True)
-        typer.secho("Processing")
-
-        process_changes(changes, folder, endpoint, workspace, credentials)
-    else:
-        typer.secho(f"\n{len(merged)} snapshot(s) found. No changes detected.\n")
+        if change:
+            changes.append(
+                {
+                    "name": name,
+                    **change,
+                    "local_date": local_date,
+                    "remote_date": remote_date,
+                }
+            )
 
+        # The topic and municipality in dfour.yaml are pushed to dfour unless
+        # the snapshot is replaced by the remote one
+        if (
+            local
+            and remote
+            and not (change and change["type"] == "download-replace")
+            and local["topic"] is not None
+            and local["bfsNumber"] is not None
+            and (local["topic"], local["bfsNumber"])
+            != (remote["topic"], remote["bfsNumber"])
+        ):
+            changes.append(
+                {
+                    "name": name,
+                    "type": "update",
+                    "source": local["datafile"],
+                    "target": remote["pk"],
+                    "title": remote["title"],
+                    "topic": local["topic"],
+                    "bfsNumber": local["bfsNumber"],
+                    "local_date": local_date,
+                    "remote_date": remote_date,
+                }
+            )
 
-# Helpers
+    return changes
 
 
-def get_local_data(folder, config_data_raw, workspace, noninteractive):
+def get_local_data(folder, config_data_raw, workspace, noninteractive, jobs=1):
+    local_tz = get_local_tz()
     local_snaps = {"folder": folder, "snapshots": {}}
 
     config_data = config_data_raw[workspace]["snapshots"]
+    config_changed = False
+    state = read_local_state(folder)
+    files = {}
+    scanned = {}
 
-    for snap_file in [
+    snap_files = [
         f for f in os.listdir(folder) if not f.startswith(".") and f.endswith(".json")
-    ]:
-        with open(f"{folder}/{snap_file}") as file_:
-            fname = pathlib.Path(f"{folder}/{snap_file}")
-            mtime = local_tz.localize(
-                datetime.datetime.fromtimestamp(fname.stat().st_mtime)
+    ]
+    stats = {}
+    stale = []
+    for snap_file in snap_files:
+        stat = pathlib.Path(f"{folder}/{snap_file}").stat()
+        stats[snap_file] = stat
+
+        # Files unchanged since the last run are not parsed again
+        entry = state["files"].get(snap_file)
+        if (
+            not entry
+            or entry["stat"] != [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+            or get_hash_algorithm(entry) != config.HASH_ALGORITHM
+        ):
+            stale.append(snap_file)
+        else:
+            scanned[snap_file] = entry
+
+    # Parsing and hashing are CPU bound and fan out to processes, the
+    # prompts below only start once all files are scanned
+    paths = [f"{folder}/{snap_file}" for snap_file in stale]
+    algorithms = [config.HASH_ALGORITHM] * len(paths)
+    if jobs > 1 and len(paths) > 1:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                scan_local_file, paths, algorithms, chunksize=chunksize
             )
-            mtime = mtime.replace(microsecond=0)
-            f_data = js.load(file_)
-
-            snap_name = resolve_name(f_data)
+            parsed = []
+            for data, spans in results:
+                # The hash spans of the workers count towards `--profile`
+                tracing.replay(spans)
+                parsed.append(data)
+    else:
+        parsed = list(map(parse_local_file, paths, algorithms))
+    for snap_file, data in zip(stale, parsed):
+        stat = stats[snap_file]
+        scanned[snap_file] = {
+            "stat": [stat.st_mtime_ns, stat.st_size, stat.st_ino],
+            **data,
+            "pk": None,
+            "fingerprint": None,
+        }
 
-            if (
-                type(config_data) == dict
-                and snap_name not in [k for k, v in config_data.items()]
-            ) or type(config_data) != dict:
-                typer.secho(
-                    f"\"{f_data['name']}\" is not in {folder}/dfour.yaml for the workspace.",
-                    fg=typer.colors.RED,
-                )
-                if not noninteractive:
-                    topic = None
-                    bfsNumber = None
-                    while not topic:
-                        topic = typer.prompt(
-                            f"Whats the topic for {snap_name}? [e.g. Structure]",
-                        )
-                    while not bfsNumber:
-                        bfsNumber = typer.prompt(
-                            f"Whats the bfsNumber for {snap_name}? [e.g. 273]",
-                        )
-
-                    config_data[snap_name] = dict(topic=topic, bfsNumber=int(bfsNumber))
-                    config_data_raw[workspace]["snapshots"] = config_data
-
-                    with open(f"{folder}/dfour.yaml", "w") as config_file:
-                        ym.dump(config_data_raw, config_file)
-
-            local_snap = {
-                "name": snap_name,
-                "pk": "",
-                "topic": config_data[snap_name]["topic"]
-                if snap_name in config_data.keys()
-                and "topic" in config_data[snap_name].keys()
-                else None,
-                "title": f_data["title"] if "title" in f_data.keys() else None,
-                "bfsNumber": config_data[snap_name]["bfsNumber"]
-                if snap_name in config_data.keys()
-                and "bfsNumber" in config_data[snap_name].keys()
-                else None,
-                "datafile": f"{folder}/{snap_file}",
-                "last_modified": mtime,
-                "hash": hashlib.sha256(
-                    js.dumps(f_data, separators=(",", ":"), sort_keys=True).encode(
-                        "utf-8"
+    for snap_file in snap_files:
+        mtime = local_tz.localize(
+            datetime.datetime.fromtimestamp(stats[snap_file].st_mtime)
+        )
+        mtime = mtime.replace(microsecond=0)
+        entry = scanned[snap_file]
+        files[snap_file] = entry
+
+        snap_name = entry["name"]
+
+        if (
+            type(config_data) == dict
+            and snap_name not in [k for k, v in config_data.items()]
+        ) or type(config_data) != dict:
+            typer.secho(
+                f'"{snap_name}" is not in {folder}/dfour.yaml for the workspace.',
+                fg=typer.colors.RED,
+            )
+            if not noninteractive:
+                topic = None
+                bfsNumber = None
+                while not topic:
+                    topic = typer.prompt(
+                        f"Whats the topic for {snap_name}? [e.g. Structure]",
                     )
-                ).hexdigest(),
-            }
+                while not bfsNumber:
+                    bfsNumber = typer.prompt(
+                        f"Whats the bfsNumber for {snap_name}? [e.g. 273]",
+                    )
+
+                config_data[snap_name] = dict(topic=topic, bfsNumber=int(bfsNumber))
+                config_data_raw[workspace]["snapshots"] = config_data
+                config_changed = True
+
+        local_snap = {
+            "name": snap_name,
+            "pk": "",
+            "topic": config_data[snap_name]["topic"]
+            if snap_name in config_data.keys()
+            and "topic" in config_data[snap_name].keys()
+            else None,
+            "title": entry["title"],
+            "bfsNumber": config_data[snap_name]["bfsNumber"]
+            if snap_name in config_data.keys()
+            and "bfsNumber" in config_data[snap_name].keys()
+            else None,
+            "datafile": f"{folder}/{snap_file}",
+            "last_modified": mtime,
+            "hash": entry["hash"],
+        }
+
+        local_snaps["snapshots"][snap_name] = local_snap
 
-            local_snaps["snapshots"][snap_name] = local_snap
+    if config_changed:
+        write_config(folder, config_data_raw)
+
+    state["files"] = files
+    write_local_state(folder, state)
 
     return local_snaps
 
 
-def get_remote_data(endpoint, workspace):
+def parse_local_file(path, algorithm):
+    # The command owns the process and may pause the garbage collector
+    f_data = helpers.load_json(path, pause_gc=True)
+    return {
+        "name": resolve_name(f_data),
+        "title": f_data["title"] if "title" in f_data.keys() else None,
+        "hash": helpers.hash_json(f_data, algorithm=algorithm),
+        "hashAlgorithm": algorithm,
+    }
+
 
-    remote_snaps = {"hash": "", "snapshots": {}}
+def scan_local_file(path, algorithm):
+    # Runs in a worker process, its spans are returned to the parent
+    with tracing.collect() as spans:
+        data = parse_local_file(path, algorithm)
+    return data, spans
 
-    baseUrl = get_endpoint_url(endpoint)
 
-    transport = RequestsHTTPTransport(url=baseUrl)
-    client = Client(transport=transport, fetch_schema_from_transport=True)
+def get_remote_data(endpoint, workspace, schema=True, http_cache=False):
+    from gql import gql
+    from .. import client
+
+    gmt = get_server_tz()
+    remote_snaps = {"hash": "", "snapshots": {}, "fingerprints": {}}
+
+    baseUrl = get_endpoint_url(endpoint)
 
     params = {
         "wshash": base64.b64encode(
@@ -301,7 +402,6 @@ def get_remote_data(endpoint, workspace):
             bfsNumber
           }
           datafile
-          data
         }
       }
     }
@@ -309,7 +409,7 @@ def get_remote_data(endpoint, workspace):
     )
 
     try:
-        result = client.execute(query, variable_values=params)
+        result = client.execute(baseUrl, query, params, schema=schema)
         result = result["workspace"]
     except Exception as e:
         raise ValueError(
@@ -319,10 +419,54 @@ def get_remote_data(endpoint, workspace):
     remote_snaps["hash"] = workspace
 
     if result:
-        for snap in result["snapshots"]:
-            path = f'{endpoint}/media/{snap["datafile"]}'
+        snapshots = result["snapshots"]
+        paths = [f'{endpoint}/media/{snap["datafile"]}' for snap in snapshots]
+        index_path = get_remote_index_path(endpoint, workspace)
+        index = read_remote_index(index_path)
+
+        with ThreadPoolExecutor(max_workers=config.POOL_SIZE) as executor:
+            responses = list(executor.map(client.head, paths))
+            fingerprints = [
+                get_fingerprint(snap, r) for snap, r in zip(snapshots, responses)
+            ]
+
+            # Only snapshots changed since the last run are downloaded
+            stale = [
+                (snap, fingerprint)
+                for snap, fingerprint in zip(snapshots, fingerprints)
+                if index.get(snap["pk"], {}).get("fingerprint") != fingerprint
+                or get_hash_algorithm(index[snap["pk"]]) != config.HASH_ALGORITHM
+            ]
+            if http_cache:
+                # Downloads fill the HTTP cache the later downloads of changes revalidate
+                datas = executor.map(
+                    lambda item: download_snapshot_data(endpoint, item[0]), stale
+                )
+            else:
+                # Stale snapshots are fetched in batches of aliased queries
+                batches = [
+                    stale[start : start + config.BATCH_SIZE]
+                    for start in range(0, len(stale), config.BATCH_SIZE)
+                ]
+                datas = executor.map(
+                    lambda batch: get_snapshot_datas(
+                        endpoint, [snap["pk"] for snap, _ in batch], schema
+                    ),
+                    batches,
+                )
+                datas = [data for batch in datas for data in batch]
+            for (snap, fingerprint), data in zip(stale, datas):
+                index[snap["pk"]] = {
+                    "fingerprint": fingerprint,
+                    "name": resolve_name(data),
+                    "hash": helpers.hash_json(data),
+                    "hashAlgorithm": config.HASH_ALGORITHM,
+                }
+
+        index = {snap["pk"]: index[snap["pk"]] for snap in snapshots}
+        helpers.write_atomic(index_path, js.dumps(index))
 
-            r = requests.get(path)
+        for snap, r in zip(snapshots, responses):
             mtime = gmt.localize(
                 datetime.datetime.strptime(
                     r.headers["last-modified"], "%a, %d %b %Y %H:%M:%S %Z"
@@ -331,7 +475,7 @@ def get_remote_data(endpoint, workspace):
             mtime = mtime.replace(tzinfo=gmt)
 
             try:
-                name = resolve_name(snap["data"])
+                name = index[snap["pk"]]["name"]
 
                 remote_snap = {
                     "name": name,
@@ -341,13 +485,10 @@ def get_remote_data(endpoint, workspace):
                     "bfsNumber": snap["municipality"]["bfsNumber"],
                     "datafile": f'{endpoint}/media/{snap["datafile"]}',
                     "last_modified": mtime,
-                    "hash": hashlib.sha256(
-                        js.dumps(
-                            snap["data"], separators=(",", ":"), sort_keys=True
-                        ).encode("utf-8")
-                    ).hexdigest(),
+                    "hash": index[snap["pk"]]["hash"],
                 }
                 remote_snaps["snapshots"][name] = remote_snap
+                remote_snaps["fingerprints"][name] = index[snap["pk"]]["fingerprint"]
 
             except Exception as e:
                 raise ValueError(f"Extraction failed.\nError: {e}")
@@ -355,50 +496,288 @@ def get_remote_data(endpoint, workspace):
     return remote_snaps
 
 
+def get_snapshot_datas(endpoint, pks, schema=True):
+    from frictionless import system
+    from ..dfour import DfourDialect
+
+    storage = system.create_storage(
+        "dfour", endpoint, dialect=DfourDialect(fetchSchema=schema)
+    )
+
+    try:
+        return list(storage.read_packages(pks))
+    except Exception as e:
+        raise ValueError(
+            f"GraphQL API query for {get_endpoint_url(endpoint)} failed.\nSnapshots: {pks}\nError: {e}"
+        )
+
+
+def download_snapshot_data(endpoint, snap):
+    from .. import client
+    from .. import protocol
+
+    url = protocol.datafile_url(endpoint, snap["datafile"])
+    try:
+        key = protocol.datafile_key(endpoint, snap["pk"])
+        return helpers.load_json(client.download(url, key=key), pause_gc=True)
+    except Exception as e:
+        raise ValueError(f"Download of {url} failed.\nError: {e}")
+
+
+def get_fingerprint(snap, response):
+    # The datafile name changes with every upload, the validators with every write
+    return ":".join(
+        [
+            snap["datafile"],
+            response.headers.get("etag", ""),
+            response.headers.get("content-length", ""),
+            response.headers.get("last-modified", ""),
+        ]
+    )
+
+
+def get_hash_algorithm(entry):
+    # Entries written before the algorithm was recorded are sha256 hashes
+    return entry.get("hashAlgorithm", "sha256")
+
+
+def get_remote_index_path(endpoint, workspace):
+    digest = hashlib.sha256(f"{endpoint}:{workspace}".encode("utf-8")).hexdigest()
+    return helpers.cache_path("workspaces", f"{digest[:16]}.json")
+
+
+def read_remote_index(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as file:
+            return js.load(file)
+    except ValueError:
+        return {}
+
+
+def get_server_tz():
+    import pytz
+
+    return pytz.timezone("GMT")  # server timezone -> should be inferred from request
+
+
+@functools.lru_cache(maxsize=None)
+def get_local_tz():
+    from tzlocal import get_localzone
+
+    return get_localzone()  # current systems timezone
+
+
 def get_endpoint_url(endpoint):
     return f"{endpoint}/graphql/"
 
 
-def process_changes(changes, folder, endpoint, workspace, credentials):
+def process_changes(
+    changes,
+    folder,
+    endpoint,
+    workspace,
+    credentials,
+    schema=True,
+    jobs=1,
+    config_data=None,
+):
+    if config_data is None:
+        config_data = read_config(folder)
+    config_lock = threading.Lock()
+    # New uploads look up and create snapshots by title in one shared index
+    index = helpers.SnapshotIndex()
+    failed = []
+
+    # The changes of a snapshot e.g. an upload-replace and an update run in
+    # order in one worker, only different snapshots run concurrently
+    groups = {}
     for change in changes:
-        if change["type"] == "download" or change["type"] == "download-replace":
-            modTime = time.mktime(
-                change["remote_date"].astimezone(local_tz).timetuple()
+        groups.setdefault(change["name"], []).append(change)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                apply_changes,
+                group,
+                folder,
+                endpoint,
+                workspace,
+                credentials,
+                schema,
+                config_data,
+                config_lock,
+                index,
             )
+            for group in groups.values()
+        ]
+        for number, future in enumerate(futures, start=1):
+            for change, e in future.result():
+                failed.append(change)
+                typer.secho(
+                    f'{change["type"]} of "{change["name"]}" failed: {e}',
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+            # Checkpoint so an interrupted sync keeps the finished downloads
+            if number % config.CONFIG_CHECKPOINT == 0:
+                with config_lock:
+                    write_config(folder, config_data)
 
-            storage = system.create_storage(
-                "dfour", endpoint, dialect=DfourDialect(snapshotHash=change["source"])
-            )
+    with config_lock:
+        write_config(folder, config_data)
+
+    return failed
+
+
+def apply_changes(changes, *args):
+    """Apply the changes of one snapshot in order, see `apply_change`
+
+    Returns:
+        list: failed changes and their errors, changes after a failed one
+            are skipped and fail too
+    """
+    failures = []
+    for change in changes:
+        if failures:
+            failures.append((change, f'skipped after the {failures[0][0]["type"]}'))
+            continue
+        try:
+            apply_change(change, *args)
+        except Exception as e:
+            failures.append((change, e))
+    return failures
+
+
+def apply_change(
+    change,
+    folder,
+    endpoint,
+    workspace,
+    credentials,
+    schema,
+    config_data,
+    config_lock,
+    index,
+):
+    from frictionless import Package, system
+    from ..dfour import DfourDialect
+
+    if change["type"] == "download" or change["type"] == "download-replace":
+        local_tz = get_local_tz()
+        modTime = time.mktime(change["remote_date"].astimezone(local_tz).timetuple())
+
+        storage = system.create_storage(
+            "dfour",
+            endpoint,
+            dialect=DfourDialect(
+                snapshotHash=change["source"],
+                fetchSchema=schema,
+                httpCache=credentials["httpCache"],
+            ),
+        )
+        if helpers.is_installed("ijson"):
+            # Streams the snapshot to disk without holding it in memory
+            storage.download_package(change["target"])
+        else:
             pkg = storage.read_package()
 
             with open(change["target"], "w") as output_file:
                 js.dump(pkg, output_file, indent=4)
-                with open(f"{folder}/dfour.yaml", "r") as config_read:
-                    config_read = ym.safe_load(config_read)
-                    config_read[workspace]["snapshots"][change["name"]] = dict(
-                        topic=change["topic"], bfsNumber=change["bfsNumber"]
-                    )
-                    with open(f"{folder}/dfour.yaml", "w") as config_write:
-                        ym.dump(config_read, config_write)
-            os.utime(change["target"], (modTime, modTime))
-
-        elif change["type"] == "upload" or change["type"] == "upload-replace":
-            storage = system.create_storage(
-                "dfour",
-                endpoint,
-                dialect=DfourDialect(
-                    snapshotHash=change["target"] if change["target"] != "" else None,
-                    workspaceHash=workspace,
-                    bfsMunicipality=change["bfsNumber"],
-                    snapshotTopic=change["topic"],
-                    username=credentials["username"],
-                    password=credentials["password"],
-                ),
+        with config_lock:
+            config_data[workspace]["snapshots"][change["name"]] = dict(
+                topic=change["topic"], bfsNumber=change["bfsNumber"]
             )
-            pkg = Package(change["source"])
-            storage.write_package(pkg.to_copy(), force=True)
+        os.utime(change["target"], (modTime, modTime))
+
+    elif change["type"] == "upload" or change["type"] == "upload-replace":
+        # Uploads share the login session of the workspace, see `client.get_login`
+        storage = system.create_storage(
+            "dfour",
+            endpoint,
+            dialect=DfourDialect(
+                snapshotHash=change["target"] if change["target"] != "" else None,
+                workspaceHash=workspace,
+                bfsMunicipality=change["bfsNumber"],
+                snapshotTopic=change["topic"],
+                username=credentials["username"],
+                password=credentials["password"],
+                persistSession=credentials["persistSession"],
+                compression=credentials["compression"],
+                fetchSchema=schema,
+            ),
+        )
+        pkg = Package(change["source"])
+        storage.write_package(pkg.to_copy(), force=True, index=index)
+
+    elif change["type"] == "update":
+        storage = system.create_storage(
+            "dfour",
+            endpoint,
+            dialect=DfourDialect(
+                snapshotHash=change["target"],
+                workspaceHash=workspace,
+                bfsMunicipality=change["bfsNumber"],
+                snapshotTopic=change["topic"],
+                username=credentials["username"],
+                password=credentials["password"],
+                persistSession=credentials["persistSession"],
+                fetchSchema=schema,
+            ),
+        )
+        storage.write_metadata(change["title"])
 
 
 def resolve_name(data):
+    from slugify import slugify
+
     name = data["name"] if "name" in data.keys() else slugify(data["title"])
     return name
+
+
+def read_config(folder):
+    import yaml as ym
+
+    with open(f"{folder}/dfour.yaml") as config_file:
+        return ym.safe_load(config_file)
+
+
+def write_config(folder, config_data):
+    import yaml as ym
+
+    helpers.write_atomic(f"{folder}/dfour.yaml", ym.dump(config_data))
+
+
+def get_local_state_path(folder):
+    return f"{folder}/.dfour/state"
+
+
+def read_local_state(folder):
+    path = get_local_state_path(folder)
+    if os.path.exists(path):
+        try:
+            with open(path) as file:
+                state = js.load(file)
+            if state.get("version") == LOCAL_STATE_VERSION:
+                return state
+        except ValueError:
+            pass
+    return {"version": LOCAL_STATE_VERSION, "files": {}}
+
+
+def write_local_state(folder, state):
+    os.makedirs(f"{folder}/.dfour", exist_ok=True)
+    helpers.write_atomic(get_local_state_path(folder), js.dumps(state, indent=2))
+
+
+def update_local_state(folder, local_data, remote_data):
+    # Remember which remote snapshot each unchanged local file was synced with
+    state = read_local_state(folder)
+    for entry in state["files"].values():
+        local = local_data["snapshots"].get(entry["name"])
+        remote = remote_data["snapshots"].get(entry["name"])
+        if local and remote and local["hash"] == remote["hash"]:
+            entry["pk"] = remote["pk"]
+            entry["fingerprint"] = remote_data["fingerprints"][entry["name"]]
+    write_local_state(folder, state)
@@ -0,0 +1,213 @@
+import os
+import base64
+from gql import gql
+from . import client
+from . import config
+
+
+# Dfour API pieces shared by `DfourStorage` and `AsyncDfourStorage`, the
+# storages only differ in how they send the requests
+
+
+# Documents
+
+
+WORKSPACE_SNAPSHOTS = gql(
+    """
+    query getsnapshotsinworkspace($wshash: ID!) {
+        workspace(id:$wshash){
+            snapshots{
+                pk
+                title
+            }
+        }
+    }
+    """
+)
+
+WORKSPACE_PACKAGES = gql(
+    """
+    query getworkspacesnapshots($wshash: ID!) {
+        workspace(id: $wshash) {
+            snapshots {
+                data
+            }
+        }
+    }
+    """
+)
+
+SNAPSHOT = gql(
+    """
+    query getsnapshot($hash: ID!) {
+        snapshot(id: $hash) {
+            data
+        }
+    }
+    """
+)
+
+SNAPSHOT_DATAFILE = gql(
+    """
+    query getsnapshotdatafile($hash: ID!) {
+        snapshot(id: $hash) {
+            datafile
+        }
+    }
+    """
+)
+
+SNAPSHOT_MUTATION = gql(
+    """
+    mutation updatesnapshot($data: SnapshotMutationInput!) {
+        snapshotmutation(input: $data) {
+            snapshot {
+                pk
+            }
+        }
+    }
+    """
+)
+
+
+def dfour_id(hash, snapshot=True):
+    """Relay id of a snapshot or a workspace"""
+    if snapshot:
+        prefix = "SnapshotNode"
+    else:
+        prefix = "WorkspaceNode"
+    return base64.b64encode(f"{prefix}:{hash}".encode("ascii")).decode("ascii")
+
+
+def batch_hashes(hashes):
+    """Split snapshot hashes into batches of `config.BATCH_SIZE`"""
+    hashes = list(hashes)
+    return [
+        hashes[start : start + config.BATCH_SIZE]
+        for start in range(0, len(hashes), config.BATCH_SIZE)
+    ]
+
+
+def batch_query(hashes):
+    """GraphQL document and variables reading several snapshots at once
+
+    Every snapshot is an aliased field, read the result with `batch_data`.
+
+    Returns:
+        (DocumentNode, dict): document and variables
+    """
+    variables = ", ".join(f"$hash{index}: ID!" for index in range(len(hashes)))
+    fields = " ".join(
+        f"snapshot{index}: snapshot(id: $hash{index}) {{ data }}"
+        for index in range(len(hashes))
+    )
+    query = gql(f"query getsnapshots({variables}) {{ {fields} }}")
+
+    params = {f"hash{index}": dfour_id(hash) for index, hash in enumerate(hashes)}
+    return query, params
+
+
+def batch_data(hashes, result):
+    """Snapshot data of a `batch_query` result, None for missing snapshots"""
+    datas = []
+    for index in range(len(hashes)):
+        snapshot = result[f"snapshot{index}"]
+        datas.append(snapshot["data"] if snapshot else None)
+    return datas
+
+
+def snapshot_input(workspace, title, topic, bfsNumber, pk=None):
+    """Variables of `SNAPSHOT_MUTATION` creating or updating a snapshot"""
+    data = {
+        "title": title,
+        "topic": topic,
+        "bfsNumber": bfsNumber,
+        "wshash": dfour_id(workspace),
+    }
+    if pk:
+        data = {"id": pk, **data}
+    return {"data": data}
+
+
+# Login
+
+
+def get_credentials(username, password):
+    """Username and password, "env:<NAME>" values are read from the environment"""
+    if username.startswith("env:"):
+        username = os.environ.get(username[4:])
+    if password.startswith("env:"):
+        password = os.environ.get(password[4:])
+    return username, password
+
+
+# Datafiles
+
+
+def datafile_url(url, datafile):
+    return f"{url}/media/{datafile}"
+
+
+def datafile_key(url, pk):
+    """HTTP cache key of the datafile of a snapshot, see `client.download`
+
+    Every upload stores a new datafile, downloads keyed by snapshot replace
+    the cached file of the previous one.
+    """
+    return f"{url}/snapshots/{pk}"
+
+
+# Uploads
+
+
+def upload_url(url, pk):
+    return f"{url}/api/v1/snapshots/{pk}/"
+
+
+def upload_filename(pk, package):
+    return f"{pk}-{package.name}.json"
+
+
+def is_rejected(url, status, response_url):
+    """Whether the server didn't accept the session of a request"""
+    return status in (401, 403) or str(response_url).startswith(client.login_url(url))
+
+
+class UploadRetry:
+    """Decides whether and how an upload is sent again
+
+    Uploads are sent again once after logging in again, a reused session
+    might have expired in the meantime, and uncompressed if the server
+    doesn't understand compressed request bodies.
+
+    Parameters:
+        url (str): dfour instance url
+        encoding? (str): requested content encoding
+
+    Attributes:
+        encoding (str): content encoding of the next attempt
+    """
+
+    LOGIN = "login"
+    UNCOMPRESS = "uncompress"
+
+    def __init__(self, url, encoding=None):
+        self.url = url
+        self.encoding = encoding if client.accepts_encoding(url) else None
+        self.__login = True
+
+    def check(self, status, response_url):
+        """What to do after a response
+
+        Returns:
+            str?: `LOGIN` to log in and send again, `UNCOMPRESS` to send
+                again without encoding, None if the upload is done
+        """
+        if self.__login and is_rejected(self.url, status, response_url):
+            self.__login = False
+            return self.LOGIN
+        if self.encoding and status in (400, 415):
+            client.reject_encoding(self.url)
+            self.encoding = None
+            return self.UNCOMPRESS
+        return None
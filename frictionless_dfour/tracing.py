@@ -0,0 +1,155 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Hooks
+
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Call a function with every finished span
+
+    Hooks are called from the thread the span ran in, e.g. to forward
+    spans to OpenTelemetry or a metrics library.
+
+    Parameters:
+        hook (func): function taking a `Span`
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Stop calling a function added with `add_hook`"""
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+# Spans
+
+
+class Span:
+    """Timed network call or processing phase
+
+    Parameters:
+        name (str): span name e.g. "graphql" or "hash"
+        **attributes: span attributes e.g. `url`
+
+    Attributes:
+        duration (float): seconds the span took
+        bytes (int): bytes sent or received, None if unknown
+        status (int|str): HTTP status or "error", None if unknown
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.bytes = None
+        self.status = None
+
+    def __repr__(self):
+        return f"<Span {self.name} {self.duration:.3f}s bytes={self.bytes} status={self.status}>"
+
+
+@contextmanager
+def span(name, **attributes):
+    """Measure a block as a span passed to the hooks once it's finished
+
+    ```python
+    with tracing.span("upload", url=url) as span:
+        response = ...
+        span.bytes = len(body)
+        span.status = response.status_code
+    ```
+    """
+    current = Span(name, **attributes)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        replay([current])
+
+
+@contextmanager
+def collect():
+    """Collect the spans finished in a block, of all threads
+
+    Worker processes collect their spans and send them back to be passed
+    to the hooks of the parent with `replay`.
+
+    ```python
+    with tracing.collect() as spans:
+        ...
+    return result, spans
+    ```
+    """
+    spans = []
+    hook = spans.append
+    add_hook(hook)
+    try:
+        yield spans
+    finally:
+        remove_hook(hook)
+
+
+def replay(spans):
+    """Pass finished spans to the hooks, e.g. spans of a worker process"""
+    for current in spans:
+        for hook in list(_hooks):
+            hook(current)
+
+
+# Profiles
+
+
+class Profile:
+    """Hook summing up spans per name
+
+    ```python
+    profile = tracing.Profile()
+    tracing.add_hook(profile)
+    ...
+    print(profile.summary())
+    ```
+
+    Spans of concurrent threads and nested spans are all counted, so the
+    total seconds of a name can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.spans = {}
+        self.__lock = threading.Lock()
+
+    def __call__(self, span):
+        with self.__lock:
+            entry = self.spans.setdefault(
+                span.name, {"count": 0, "seconds": 0.0, "bytes": 0, "errors": 0}
+            )
+            entry["count"] += 1
+            entry["seconds"] += span.duration
+            entry["bytes"] += span.bytes or 0
+            entry["errors"] += span.status == "error" or (
+                isinstance(span.status, int) and span.status >= 400
+            )
+
+    def summary(self):
+        """Table of the spans per name, the slowest first"""
+        lines = [f"{'phase':<16} {'count':>7} {'seconds':>9} {'MB':>9} {'errors':>7}"]
+        items = sorted(self.spans.items(), key=lambda item: -item[1]["seconds"])
+        for name, entry in items:
+            lines.append(
+                f"{name:<16} {entry['count']:>7} {entry['seconds']:>9.3f} "
+                f"{entry['bytes'] / 1e6:>9.2f} {entry['errors']:>7}"
+            )
+        return "\n".join(lines)
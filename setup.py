@@ -30,22 +30,30 @@ TESTS_REQUIRE = [
     "pymysql",
     "livemark",
     "psycopg2",
+    "zstandard",
+    "ijson>=3.1",
     "pytest-cov",
     "pytest-vcr",
+    "orjson>=3.6",
     "pytest-only",
     "oauth2client",
     "requests-mock",
     "python-dotenv",
     "pydoc-markdown",
     "docstring-parser",
+    "gql[aiohttp]>=3.0,<5",
 ]
 EXTRAS_REQUIRE = {
     "dev": TESTS_REQUIRE,
+    "aio": ["gql[aiohttp]>=3.0,<5"],
+    "zstd": ["zstandard"],
+    "stream": ["ijson>=3.1"],
+    "fast": ["orjson>=3.6"],
 }
+# The client supports both the gql 3 and the gql 4 request API
 INSTALL_REQUIRES = [
-    "gql",
+    "gql[requests]>=3.0,<5",
     "frictionless",
-    "dictdiffer",
     "tzlocal==2.1"
 ]
 README = read("README.md")
@@ -62,6 +70,7 @@ setup(
     version=VERSION,
     packages=PACKAGES,
     include_package_data=True,
+    python_requires=">=3.7",
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
     extras_require=EXTRAS_REQUIRE,
@@ -90,9 +99,9 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
         "Topic :: Software Development :: Libraries :: Python Modules",
     ],
 )
\ No newline at end of file
@@ -0,0 +1,63 @@
+import time
+import pytest
+import requests
+import tracemalloc
+from contextlib import contextmanager
+
+
+RESULTS = []
+
+# Fixtures
+
+
+@pytest.fixture
+def measure():
+    """Measure requests, wall time and peak memory of a block
+
+    The record yielded by `measure(url, name)` is completed with the request
+    counts of the mock dfour server at `url` (none without `url`), the wall
+    time in seconds and the peak of memory allocated by Python in bytes.
+    Tracing memory slows down allocations, `memory=False` skips it for
+    CPU bound benchmarks.
+    """
+
+    @contextmanager
+    def measure(url, name, *, memory=True):
+        if url:
+            requests.post(f"{url}/_reset")
+        record = {"name": name, "peak": None}
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if memory:
+                record["peak"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        record["stats"] = requests.get(f"{url}/_stats").json() if url else {}
+        # Schema introspections are counted among the GraphQL requests already
+        stats = record["stats"].items()
+        record["requests"] = sum(count for kind, count in stats if kind != "introspection")
+        RESULTS.append(record)
+
+    return measure
+
+
+# Reports
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.section("dfour benchmarks")
+    terminalreporter.write_line(
+        f"{'benchmark':<40} {'requests':>9} {'seconds':>9} {'peak MB':>9}"
+    )
+    for record in RESULTS:
+        peak = "-" if record["peak"] is None else f"{record['peak'] / 1e6:.1f}"
+        terminalreporter.write_line(
+            f"{record['name']:<40} {record['requests']:>9} "
+            f"{record['seconds']:>9.2f} {peak:>9}"
+        )
@@ -0,0 +1,64 @@
+import json
+import pytest
+from frictionless import Package
+from frictionless_dfour import config, helpers
+from tests.server import create_package
+
+
+BACKENDS = ["json", "orjson"]
+ROUNDS = 20
+
+# Payloads
+
+
+@pytest.fixture(params=["perimeter", "points"])
+def payload(request, tmp_path):
+    if request.param == "perimeter":
+        path = "data/perimeter.json"
+    else:
+        path = tmp_path / "points.json"
+        with open(path, "w") as file:
+            json.dump(create_package(0, 20000), file, indent=4)
+    return request.param, str(path)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setattr(config, "JSON_BACKEND", request.param)
+    return request.param
+
+
+# Parse
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("pause_gc", [False, True])
+def test_benchmark_json_load(measure, payload, backend, pause_gc):
+    name, path = payload
+    with open(path) as file:
+        expected = json.load(file)
+    label = f"{backend}, paused gc" if pause_gc else backend
+    with measure(None, f"load_json {name} [{label}]", memory=False):
+        for _ in range(ROUNDS):
+            data = helpers.load_json(path, pause_gc=pause_gc)
+
+    assert data == expected
+
+
+# Serialize
+
+
+@pytest.mark.benchmark
+def test_benchmark_json_upload(measure, payload, backend):
+    name, path = payload
+    package = Package(path)
+    with measure(None, f"upload encoding {name} [{backend}]", memory=False):
+        for _ in range(ROUNDS):
+            file = helpers.spool_json(package, separators=(",", ":"), fast=True)
+
+    # Same JSON value and the hash doesn't depend on the backend
+    assert json.load(file) == json.loads(json.dumps(package))
+    with open(path) as source:
+        assert helpers.hash_json(package) == helpers.hash_json(json.load(source))
@@ -0,0 +1,74 @@
+import math
+import pytest
+from frictionless import Package, system
+from frictionless_dfour import DfourDialect, config
+from tests.server import USERNAME, PASSWORD, WORKSPACE, create_package
+
+
+SIZES = [10, 100, 1000]
+
+# Read
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_benchmark_read_package(dfour_server, measure, size):
+    url = dfour_server(snapshots=size)
+    with measure(url, f"read_package [{size}]") as record:
+        for index in range(size):
+            dialect = DfourDialect(snapshotHash=f"S{index}")
+            storage = system.create_storage("dfour", url, dialect=dialect)
+            assert storage.read_package().title == f"Snapshot {index}"
+
+    # One query per snapshot and the schema introspection
+    assert record["requests"] <= size + 1
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_benchmark_read_packages(dfour_server, measure, size):
+    url = dfour_server(snapshots=size)
+    storage = system.create_storage("dfour", url, dialect=DfourDialect())
+    with measure(url, f"read_packages [{size}]") as record:
+        hashes = [f"S{index}" for index in range(size)]
+        packages = list(storage.read_packages(hashes))
+        assert len(packages) == size
+
+    assert record["requests"] <= math.ceil(size / config.BATCH_SIZE) + 1
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_benchmark_workspace_listing(dfour_server, measure, size):
+    url = dfour_server(snapshots=size)
+    dialect = DfourDialect(workspaceHash=WORKSPACE)
+    storage = system.create_storage("dfour", url, dialect=dialect)
+    with measure(url, f"workspace listing [{size}]") as record:
+        assert len(list(storage)) == size
+
+    assert record["requests"] <= 2
+
+
+# Write
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_benchmark_write_package(dfour_server, measure, size):
+    url = dfour_server(snapshots=0)
+    dialect = DfourDialect(
+        workspaceHash=WORKSPACE,
+        username=USERNAME,
+        password=PASSWORD,
+        snapshotTopic="Test",
+        bfsMunicipality=261,
+    )
+    storage = system.create_storage("dfour", url, dialect=dialect)
+    packages = [Package(create_package(index, 10)) for index in range(size)]
+    with measure(url, f"write_package [{size}]") as record:
+        for package in packages:
+            storage.write_package(package, force=True)
+
+    # Login, listing, schema and a mutation and an upload per snapshot
+    assert record["stats"]["PATCH api"] == size
+    assert record["requests"] <= 2 * size + 4
@@ -0,0 +1,40 @@
+import math
+import yaml
+import pytest
+from typer.testing import CliRunner
+from frictionless_dfour import program, config
+from tests.server import WORKSPACE
+
+
+SIZES = [10, 100, 1000]
+
+runner = CliRunner()
+
+
+# Sync
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("size", SIZES)
+def test_benchmark_workspace_sync(dfour_server, measure, tmp_path, size):
+    url = dfour_server(snapshots=size)
+    folder = tmp_path / "workspace"
+    folder.mkdir()
+    with open(folder / "dfour.yaml", "w") as file:
+        yaml.dump({WORKSPACE: {"endpoint": url, "snapshots": {}}}, file)
+    command = f"workspace {WORKSPACE} {folder} -y --jobs 8"
+
+    # Downloads every snapshot
+    with measure(url, f"workspace sync [{size}]") as record:
+        result = runner.invoke(program, command)
+    assert result.exit_code == 0
+    assert len(list(folder.glob("*.json"))) == size
+    assert record["stats"]["HEAD media"] == size
+    assert record["requests"] <= 2 + 2 * size + math.ceil(size / config.BATCH_SIZE)
+
+    # Nothing changed
+    with measure(url, f"workspace sync unchanged [{size}]") as record:
+        result = runner.invoke(program, command)
+    assert result.exit_code == 0
+    assert result.stdout.count("No changes detected")
+    assert record["requests"] <= 1 + size
@@ -1,5 +1,7 @@
 import os
+import sys
 import pytest
+import subprocess
 from pytest_cov.embed import cleanup_on_sigterm
 from dotenv import load_dotenv
 from frictionless_dfour import DfourDialect
@@ -41,6 +43,37 @@ def dfour_url():
         pytest.skip('Environment variable "DFOUR_WORKSPACE" is not available')
     yield url
 
+
+@pytest.fixture
+def dfour_server(tmp_path, monkeypatch):
+    """Start mock dfour servers, see `tests/server.py`
+
+    Returns a function taking the server options and returning the url of
+    the started server. Servers run in a subprocess so they don't count
+    towards the memory of the test.
+    """
+    processes = []
+    monkeypatch.setenv("DFOUR_CACHE_DIR", str(tmp_path / "cache"))
+
+    def start(**options):
+        args = [sys.executable, os.path.join(os.path.dirname(__file__), "server.py")]
+        for name, value in options.items():
+            flag = "--" + name.replace("_", "-")
+            if value is True:
+                args.append(flag)
+            elif value is not False:
+                args += [flag, str(value)]
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        return process.stdout.readline().strip()
+
+    yield start
+
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
 # Settings
 
 
@@ -52,10 +85,46 @@ def pytest_addoption(parser):
         default=False,
         help="enable integrational tests",
     )
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        dest="benchmark",
+        default=False,
+        help="enable benchmarks",
+    )
+    parser.addoption(
+        "--benchmark-max-size",
+        type=int,
+        dest="benchmark_max_size",
+        default=None,
+        help="skip benchmarks with more snapshots",
+    )
 
 
 def pytest_configure(config):
+    config.addinivalue_line("markers", "ci: integrational tests")
+    config.addinivalue_line("markers", "benchmark: benchmarks")
     if not config.option.ci:
         expr = getattr(config.option, "markexpr")
         setattr(config.option, "markexpr",
-                "{expr} and not ci" if expr else "not ci")
+                f"{expr} and not ci" if expr else "not ci")
+    if not config.option.benchmark:
+        expr = getattr(config.option, "markexpr")
+        setattr(config.option, "markexpr",
+                f"{expr} and not benchmark" if expr else "not benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    size = config.option.benchmark_max_size
+    if size is None:
+        return
+    selected = []
+    deselected = []
+    for item in items:
+        params = getattr(item, "callspec", None)
+        if params and params.params.get("size", 0) > size:
+            deselected.append(item)
+        else:
+            selected.append(item)
+    config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
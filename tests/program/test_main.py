@@ -1,3 +1,5 @@
+import sys
+import subprocess
 from typer.testing import CliRunner
 from frictionless import program, __version__
 
@@ -29,3 +31,28 @@ def test_program_error_bad_command():
     result = runner.invoke(program, "bad")
     assert result.exit_code == 2
     assert result.stdout.count("No such command 'bad'")
+
+
+# Imports
+
+
+HEAVY_MODULES = [
+    "frictionless",
+    "gql",
+    "graphql",
+    "requests",
+    "yaml",
+    "pytz",
+    "tzlocal",
+    "slugify",
+]
+
+
+def test_program_imports():
+    # Trivial invocations and plugin discovery mustn't import the storages
+    code = "import sys, frictionless_dfour.__main__; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = result.stdout.split()
+    assert [name for name in HEAVY_MODULES if name in modules] == []
@@ -1,7 +1,18 @@
+import os
+import json
+import time
+import pytest
 import shutil
+import datetime
 from typer.testing import CliRunner
 from frictionless import helpers
-from frictionless_dfour import program
+from frictionless_dfour import config, program, tracing
+from frictionless_dfour.program import workspace
+from frictionless_dfour.program.workspace import (
+    get_local_data,
+    plan_changes,
+    read_local_state,
+)
 from distutils.dir_util import copy_tree
 
 
@@ -27,3 +38,261 @@ def test_program_workspace(dfour_url, dfour_dialect):
     # if IS_UNIX:
     #     assert result.stdout.count("metadata: data/table.csv")
     #     assert result.stdout.count("hash: 6c2c61dd9b0e9c6876139a449ed87933")
+
+
+# Plan
+
+
+DATE = datetime.datetime(2022, 3, 1, 12, tzinfo=datetime.timezone.utc)
+EARLIER = DATE - datetime.timedelta(hours=1)
+
+
+def local_snap(name, hash="h1", date=DATE, topic="Test", bfsNumber=261):
+    return {
+        "name": name,
+        "datafile": f"sample/{name}.json",
+        "last_modified": date,
+        "hash": hash,
+        "topic": topic,
+        "bfsNumber": bfsNumber,
+    }
+
+
+def remote_snap(name, hash="h1", date=DATE, topic="Test", bfsNumber=261):
+    return {
+        "name": name,
+        "pk": f"pk-{name}",
+        "title": name.title(),
+        "last_modified": date,
+        "hash": hash,
+        "topic": topic,
+        "bfsNumber": bfsNumber,
+    }
+
+
+def plan(local, remote):
+    return plan_changes(
+        "sample",
+        {"snapshots": {snap["name"]: snap for snap in local}},
+        {"snapshots": {snap["name"]: snap for snap in remote}},
+    )
+
+
+def test_plan_changes_download():
+    changes = plan([], [remote_snap("a")])
+    assert changes == [
+        {
+            "name": "a",
+            "type": "download",
+            "source": "pk-a",
+            "target": "sample/a.json",
+            "topic": "Test",
+            "bfsNumber": 261,
+            "local_date": None,
+            "remote_date": DATE,
+        }
+    ]
+
+
+def test_plan_changes_upload():
+    changes = plan([local_snap("a")], [])
+    assert changes == [
+        {
+            "name": "a",
+            "type": "upload",
+            "source": "sample/a.json",
+            "target": "",
+            "topic": "Test",
+            "bfsNumber": 261,
+            "local_date": DATE,
+            "remote_date": None,
+        }
+    ]
+
+
+def test_plan_changes_download_replace():
+    changes = plan([local_snap("a", date=EARLIER)], [remote_snap("a", hash="h2")])
+    assert [change["type"] for change in changes] == ["download-replace"]
+    assert changes[0]["source"] == "pk-a"
+    assert changes[0]["target"] == "sample/a.json"
+
+
+def test_plan_changes_upload_replace():
+    changes = plan([local_snap("a", hash="h2")], [remote_snap("a", date=EARLIER)])
+    assert [change["type"] for change in changes] == ["upload-replace"]
+    assert changes[0]["source"] == "sample/a.json"
+    assert changes[0]["target"] == "pk-a"
+
+
+def test_plan_changes_equal_hashes_and_dates():
+    assert plan([local_snap("a")], [remote_snap("a")]) == []
+    assert plan([local_snap("a", date=EARLIER)], [remote_snap("a")]) == []
+
+
+def test_plan_changes_different_hashes_and_equal_dates():
+    assert plan([local_snap("a", hash="h2")], [remote_snap("a")]) == []
+
+
+def test_plan_changes_update():
+    changes = plan([local_snap("a", topic="Other")], [remote_snap("a")])
+    assert changes == [
+        {
+            "name": "a",
+            "type": "update",
+            "source": "sample/a.json",
+            "target": "pk-a",
+            "title": "A",
+            "topic": "Other",
+            "bfsNumber": 261,
+            "local_date": DATE,
+            "remote_date": DATE,
+        }
+    ]
+
+
+def test_plan_changes_update_with_upload_replace():
+    local = local_snap("a", hash="h2", bfsNumber=230)
+    changes = plan([local], [remote_snap("a", date=EARLIER)])
+    assert [change["type"] for change in changes] == ["upload-replace", "update"]
+
+
+def test_plan_changes_no_update_with_download_replace():
+    local = local_snap("a", date=EARLIER, topic="Other")
+    changes = plan([local], [remote_snap("a", hash="h2")])
+    assert [change["type"] for change in changes] == ["download-replace"]
+
+
+def test_plan_changes_no_update_without_local_metadata():
+    local = local_snap("a", topic=None, bfsNumber=None)
+    assert plan([local], [remote_snap("a")]) == []
+
+
+def test_plan_changes_sorted_by_name():
+    changes = plan([local_snap("c")], [remote_snap("b"), remote_snap("a")])
+    assert [change["name"] for change in changes] == ["a", "b", "c"]
+
+
+# Process
+
+
+def record_changes(monkeypatch, fail=()):
+    events = []
+
+    def apply_change(change, *args):
+        events.append(("start", change["name"], change["type"]))
+        if change["type"] == "upload-replace":
+            time.sleep(0.2)
+        if change["type"] in fail:
+            raise ValueError("Upload failed")
+        events.append(("end", change["name"], change["type"]))
+
+    monkeypatch.setattr(workspace, "apply_change", apply_change)
+    return events
+
+
+def process(folder, changes):
+    return workspace.process_changes(
+        changes, str(folder), "http://dfour", "TESTWS", {}, jobs=2, config_data={}
+    )
+
+
+def test_process_changes_applies_changes_of_a_snapshot_in_order(tmp_path, monkeypatch):
+    events = record_changes(monkeypatch)
+    local = [local_snap("a", hash="h2", bfsNumber=230), local_snap("b", hash="h2")]
+    remote = [remote_snap("a", date=EARLIER), remote_snap("b", date=EARLIER)]
+    changes = plan(local, remote)
+    types = [change["type"] for change in changes]
+    assert types == ["upload-replace", "update", "upload-replace"]
+
+    assert process(tmp_path, changes) == []
+    assert [event for event in events if event[1] == "a"] == [
+        ("start", "a", "upload-replace"),
+        ("end", "a", "upload-replace"),
+        ("start", "a", "update"),
+        ("end", "a", "update"),
+    ]
+    # Different snapshots still run concurrently
+    assert events.index(("start", "b", "upload-replace")) < events.index(
+        ("end", "a", "upload-replace")
+    )
+
+
+def test_process_changes_skips_changes_after_a_failed_one(tmp_path, monkeypatch):
+    events = record_changes(monkeypatch, fail=["upload-replace"])
+    local = local_snap("a", hash="h2", bfsNumber=230)
+    changes = plan([local], [remote_snap("a", date=EARLIER)])
+    assert process(tmp_path, changes) == changes
+    assert events == [("start", "a", "upload-replace")]
+
+
+# Scan
+
+
+def write_snapshots(folder, count):
+    for number in range(count):
+        package = {"name": f"snapshot-{number}", "title": f"Snapshot {number}"}
+        (folder / f"snapshot-{number}.json").write_text(json.dumps(package))
+
+
+def scan(folder, jobs=1):
+    """Local data of a folder and the number of files hashed"""
+    config_data = {"TESTWS": {"snapshots": {}}}
+    with tracing.collect() as spans:
+        local_data = get_local_data(str(folder), config_data, "TESTWS", True, jobs=jobs)
+    return local_data, len([span for span in spans if span.name == "hash"])
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_get_local_data_unchanged_files_arent_hashed_again(tmp_path, jobs):
+    write_snapshots(tmp_path, 3)
+    first, hashed = scan(tmp_path, jobs)
+    assert hashed == 3
+    second, hashed = scan(tmp_path, jobs)
+    assert hashed == 0
+    assert second == first
+
+
+def test_get_local_data_changed_files_are_hashed_again(tmp_path):
+    write_snapshots(tmp_path, 3)
+    first, _ = scan(tmp_path)
+
+    # A new size
+    path = tmp_path / "snapshot-1.json"
+    path.write_text(json.dumps({"name": "snapshot-1", "title": "Changed"}))
+    second, hashed = scan(tmp_path)
+    assert hashed == 1
+    hashes = {name: snap["hash"] for name, snap in second["snapshots"].items()}
+    assert hashes["snapshot-1"] != first["snapshots"]["snapshot-1"]["hash"]
+    assert hashes["snapshot-0"] == first["snapshots"]["snapshot-0"]["hash"]
+
+    # A new modification time only
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    third, hashed = scan(tmp_path)
+    assert hashed == 1
+    assert third["snapshots"]["snapshot-1"]["hash"] == hashes["snapshot-1"]
+
+
+def test_get_local_data_hash_algorithm_change_hashes_all_files(tmp_path, monkeypatch):
+    write_snapshots(tmp_path, 3)
+    first, _ = scan(tmp_path)
+    monkeypatch.setattr(config, "HASH_ALGORITHM", "sha1")
+    second, hashed = scan(tmp_path)
+    assert hashed == 3
+    for name, snap in second["snapshots"].items():
+        assert snap["hash"] != first["snapshots"][name]["hash"]
+        assert len(snap["hash"]) == 40
+    state = read_local_state(str(tmp_path))
+    algorithms = [entry["hashAlgorithm"] for entry in state["files"].values()]
+    assert algorithms == ["sha1"] * 3
+
+
+def test_get_local_data_scan_jobs_replay_hash_spans(tmp_path):
+    for number in range(3):
+        package = {"name": f"snapshot-{number}", "title": f"Snapshot {number}"}
+        (tmp_path / f"snapshot-{number}.json").write_text(json.dumps(package))
+    config_data = {"TESTWS": {"snapshots": {}}}
+    with tracing.collect() as spans:
+        local_data = get_local_data(str(tmp_path), config_data, "TESTWS", True, jobs=2)
+    assert sorted(local_data["snapshots"]) == ["snapshot-0", "snapshot-1", "snapshot-2"]
+    assert len([span for span in spans if span.name == "hash"]) == 3
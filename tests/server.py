@@ -0,0 +1,403 @@
+"""Local stand-in for a dfour instance
+
+Serves the GraphQL endpoint, `/account/login/`, `/api/v1/snapshots/<pk>/`
+and `/media/` of a dfour instance from memory, for tests and benchmarks
+without network access. Run it with `python tests/server.py --snapshots 100`,
+it prints its url once it's listening.
+
+Request counts are served as JSON from `GET /_stats`, schema introspections
+are counted separately too, and reset by `POST /_reset`. `POST /_expire`
+logs out all sessions.
+"""
+import sys
+import json
+import time
+import zlib
+import base64
+import hashlib
+import argparse
+import threading
+import itertools
+from collections import Counter
+from email.parser import BytesParser
+from email.utils import formatdate
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from graphql import build_schema, graphql_sync
+
+
+SCHEMA = build_schema(
+    """
+    scalar GenericScalar
+
+    type Municipality {
+        bfsNumber: Int
+    }
+
+    type SnapshotNode {
+        id: ID!
+        pk: ID!
+        title: String
+        topic: String
+        municipality: Municipality
+        datafile: String
+        data: GenericScalar
+    }
+
+    type WorkspaceNode {
+        id: ID!
+        pk: ID!
+        title: String
+        description: String
+        snapshots: [SnapshotNode]
+    }
+
+    input SnapshotMutationInput {
+        id: ID
+        title: String!
+        topic: String
+        bfsNumber: Int
+        wshash: ID
+        clientMutationId: String
+    }
+
+    type SnapshotMutationPayload {
+        snapshot: SnapshotNode
+        clientMutationId: String
+    }
+
+    type Query {
+        snapshot(id: ID!): SnapshotNode
+        workspace(id: ID!): WorkspaceNode
+    }
+
+    type Mutation {
+        snapshotmutation(input: SnapshotMutationInput!): SnapshotMutationPayload
+    }
+    """
+)
+
+USERNAME = "test"
+PASSWORD = "test"
+WORKSPACE = "TESTWS"
+
+
+# Data
+
+
+def create_package(index, features):
+    """Snapshot package with a GeoJSON resource of `features` points"""
+    return {
+        "name": f"snapshot-{index}",
+        "title": f"Snapshot {index}",
+        "resources": [
+            {
+                "name": "points",
+                "mediatype": "application/geo+json",
+                "data": {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {
+                            "type": "Feature",
+                            "properties": {"id": number, "name": f"point-{number}"},
+                            "geometry": {
+                                "type": "Point",
+                                "coordinates": [8.5 + number * 1e-5, 47.3 + index * 1e-5],
+                            },
+                        }
+                        for number in range(features)
+                    ],
+                },
+            }
+        ],
+        "views": [{"name": "map", "specType": "gemeindescanSnapshot", "resources": ["points"]}],
+    }
+
+
+def decode_id(value):
+    try:
+        return base64.b64decode(value).decode("utf-8").split(":", 1)[1]
+    except Exception:
+        return value
+
+
+class Instance:
+    """In-memory state of a dfour instance
+
+    Parameters:
+        snapshots? (int): number of snapshots in the workspace
+        features? (int): number of GeoJSON features per snapshot
+        latency? (float): seconds to wait before answering each request
+        rejectEncoding? (int): status answering compressed uploads, e.g. 415
+        loginRedirect? (bool): redirect uploads without a session to the login
+    """
+
+    def __init__(
+        self,
+        snapshots=10,
+        features=10,
+        latency=0.0,
+        rejectEncoding=0,
+        loginRedirect=False,
+    ):
+        self.latency = latency
+        self.rejectEncoding = rejectEncoding
+        self.loginRedirect = loginRedirect
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.snapshots = {}
+        self.media = {}
+        self.counter = itertools.count(1)
+        for index in range(snapshots):
+            self.store(f"S{index}", create_package(index, features), "Test", 261)
+
+    def store(self, pk, data, topic, bfsNumber):
+        content = json.dumps(data).encode("utf-8")
+        datafile = f"snapshots/{pk}-{next(self.counter)}.json"
+        with self.lock:
+            previous = self.snapshots.get(pk)
+            if previous:
+                self.media.pop(previous["datafile"], None)
+            self.media[datafile] = {
+                "content": content,
+                "etag": '"%s"' % hashlib.sha1(content).hexdigest(),
+                "modified": formatdate(time.time(), usegmt=True),
+            }
+            self.snapshots[pk] = {
+                "id": base64.b64encode(f"SnapshotNode:{pk}".encode()).decode(),
+                "pk": pk,
+                "title": data.get("title", pk),
+                "topic": topic,
+                "municipality": {"bfsNumber": bfsNumber},
+                "datafile": datafile,
+                "data": data,
+            }
+
+    # GraphQL
+
+    def execute(self, body, authenticated):
+        root = {
+            "snapshot": self.resolve_snapshot,
+            "workspace": self.resolve_workspace,
+            "snapshotmutation": self.resolve_mutation,
+        }
+        result = graphql_sync(
+            SCHEMA,
+            body["query"],
+            root_value=root,
+            context_value={"authenticated": authenticated},
+            variable_values=body.get("variables"),
+            operation_name=body.get("operationName"),
+        )
+        response = {"data": result.data}
+        if result.errors:
+            response["errors"] = [error.formatted for error in result.errors]
+        return response
+
+    def resolve_snapshot(self, info, id):
+        return self.snapshots.get(decode_id(id))
+
+    def resolve_workspace(self, info, id):
+        if decode_id(id) != WORKSPACE:
+            return None
+        with self.lock:
+            snapshots = list(self.snapshots.values())
+        return {
+            "id": id,
+            "pk": WORKSPACE,
+            "title": "Test workspace",
+            "description": "",
+            "snapshots": snapshots,
+        }
+
+    def resolve_mutation(self, info, input):
+        if not info.context["authenticated"]:
+            raise Exception("You do not have permission to perform this action")
+        pk = input.get("id")
+        if pk:
+            snapshot = self.snapshots[pk]
+            snapshot.update(
+                title=input["title"],
+                topic=input.get("topic"),
+                municipality={"bfsNumber": input.get("bfsNumber")},
+            )
+        else:
+            pk = f"N{next(self.counter)}"
+            data = {"name": pk.lower(), "title": input["title"], "resources": []}
+            self.store(pk, data, input.get("topic"), input.get("bfsNumber"))
+        return {"snapshot": self.snapshots[pk]}
+
+    # Uploads
+
+    def upload(self, pk, headers, body):
+        encoding = headers.get("Content-Encoding")
+        if encoding and self.rejectEncoding:
+            return self.rejectEncoding
+        if encoding == "gzip":
+            body = zlib.decompress(body, wbits=31)
+        elif encoding == "zstd":
+            import zstandard
+
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        elif encoding:
+            return 415
+        message = BytesParser().parsebytes(
+            f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        for part in message.get_payload():
+            if part.get_param("name", header="content-disposition") == "data_file":
+                data = json.loads(part.get_payload(decode=True))
+                snapshot = self.snapshots[pk]
+                self.store(
+                    pk, data, snapshot["topic"], snapshot["municipality"]["bfsNumber"]
+                )
+                return 200
+        return 400
+
+
+# Server
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def instance(self):
+        return self.server.instance
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def handle_request(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        path = self.path.split("?")[0]
+
+        if path == "/_stats":
+            return self.send(200, json.dumps(self.instance.stats).encode())
+        if path == "/_reset":
+            self.instance.stats.clear()
+            return self.send(200)
+        if path == "/_expire":
+            self.instance.sessions.clear()
+            return self.send(200)
+
+        kind = path.strip("/").split("/")[0]
+        with self.instance.lock:
+            self.instance.stats[f"{method} {kind}"] += 1
+        if self.instance.latency:
+            time.sleep(self.instance.latency)
+
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        session = cookies["sessionid"].value if "sessionid" in cookies else None
+        authenticated = session in self.instance.sessions
+
+        if path == "/graphql/" and method == "POST":
+            body = json.loads(body)
+            if "__schema" in body["query"]:
+                with self.instance.lock:
+                    self.instance.stats["introspection"] += 1
+            response = self.instance.execute(body, authenticated)
+            # Like Django, authenticated responses renew the CSRF cookie
+            cookies = ["csrftoken=token; Path=/"] if authenticated else []
+            return self.send(200, json.dumps(response).encode(), cookies=cookies)
+
+        if path == "/account/login/" and method == "GET":
+            return self.send(200, cookies=["csrftoken=token; Path=/"])
+
+        if path == "/account/login/" and method == "POST":
+            form = {key: value[0] for key, value in parse_qs(body.decode()).items()}
+            if form.get("username") == USERNAME and form.get("password") == PASSWORD:
+                session = hashlib.sha1(str(time.time()).encode()).hexdigest()
+                self.instance.sessions.add(session)
+                return self.send(200, cookies=[f"sessionid={session}; Path=/"])
+            return self.send(200)
+
+        if path.startswith("/api/v1/snapshots/") and method == "PATCH":
+            pk = path.strip("/").split("/")[-1]
+            if not authenticated and self.instance.loginRedirect:
+                location = f"/account/login/?next={path}"
+                return self.send(302, headers={"Location": location})
+            if not authenticated or self.headers.get("X-CSRFToken") != "token":
+                return self.send(403)
+            if pk not in self.instance.snapshots:
+                return self.send(404)
+            return self.send(self.instance.upload(pk, self.headers, body))
+
+        if path.startswith("/media/") and method in ("GET", "HEAD"):
+            media = self.instance.media.get(path[len("/media/") :])
+            if not media:
+                return self.send(404)
+            headers = {"ETag": media["etag"], "Last-Modified": media["modified"]}
+            if self.headers.get("If-None-Match") == media["etag"]:
+                return self.send(304, headers=headers)
+            return self.send(200, media["content"], headers=headers, head=method == "HEAD")
+
+        self.send(404)
+
+    def send(self, status, body=b"", *, headers=None, cookies=(), head=False):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        for cookie in cookies:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        if body and not head:
+            self.wfile.write(body)
+
+
+def create_server(*, port=0, **options):
+    """Create a mock dfour server listening on localhost
+
+    Parameters:
+        port? (int): port to listen on, a free one by default
+        **options: `Instance` options
+
+    Returns:
+        ThreadingHTTPServer: server, call `serve_forever` to run it
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.instance = Instance(**options)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshots", type=int, default=10)
+    parser.add_argument("--features", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--reject-encoding", type=int, default=0)
+    parser.add_argument("--login-redirect", action="store_true")
+    args = parser.parse_args(argv)
+    server = create_server(
+        snapshots=args.snapshots,
+        features=args.features,
+        latency=args.latency,
+        rejectEncoding=args.reject_encoding,
+        loginRedirect=args.login_redirect,
+        port=args.port,
+    )
+    print(f"http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import os
+import asyncio
+import pytest
+import requests
+from frictionless import Package
+from frictionless.exception import FrictionlessException
+from frictionless_dfour import AsyncDfourStorage, DfourDialect, tracing
+from tests.server import USERNAME, PASSWORD, WORKSPACE, create_package
+
+
+pytest.importorskip("aiohttp")
+
+
+# Helpers
+
+
+def create_storage(url, **options):
+    dialect = DfourDialect(
+        workspaceHash=WORKSPACE,
+        username=USERNAME,
+        password=PASSWORD,
+        snapshotTopic="Test",
+        bfsMunicipality=261,
+        **options,
+    )
+    return AsyncDfourStorage(url, dialect=dialect)
+
+
+def run(url, function, **options):
+    async def main():
+        async with create_storage(url, **options) as storage:
+            return await function(storage)
+
+    return asyncio.run(main())
+
+
+# Read
+
+
+def test_aio_storage_read_package(dfour_server):
+    url = dfour_server(snapshots=2, features=3)
+
+    async def read(storage):
+        return await storage.read_package(snapshotHash="S1")
+
+    pkg = run(url, read)
+    assert pkg.title == "Snapshot 1"
+    assert pkg == Package(create_package(1, 3))
+
+
+def test_aio_storage_read_package_http_cache(dfour_server):
+    url = dfour_server(snapshots=1, features=3)
+
+    async def read(storage):
+        return await storage.read_package(snapshotHash="S0")
+
+    pkg = run(url, read, httpCache=True)
+    assert pkg == Package(create_package(0, 3))
+
+
+def test_aio_storage_read_package_missing(dfour_server):
+    url = dfour_server(snapshots=1)
+
+    async def read(storage):
+        return await storage.read_package(snapshotHash="S9")
+
+    with pytest.raises(FrictionlessException) as excinfo:
+        run(url, read)
+    assert "doesn't exist" in str(excinfo.value)
+
+
+def test_aio_storage_read_packages(dfour_server):
+    url = dfour_server(snapshots=5, features=2)
+
+    async def read(storage):
+        return await storage.read_packages(["S3", "S0", "S4"])
+
+    packages = run(url, read)
+    assert [pkg.title for pkg in packages] == ["Snapshot 3", "Snapshot 0", "Snapshot 4"]
+
+
+def test_aio_storage_iterate(dfour_server):
+    url = dfour_server(snapshots=3)
+
+    async def iterate(storage):
+        return [snapshot async for snapshot in storage]
+
+    snapshots = run(url, iterate)
+    assert [snapshot["pk"] for snapshot in snapshots] == ["S0", "S1", "S2"]
+    assert [snapshot["title"] for snapshot in snapshots] == [
+        "Snapshot 0",
+        "Snapshot 1",
+        "Snapshot 2",
+    ]
+
+
+def test_aio_storage_read_package_lazy(dfour_server):
+    pytest.importorskip("ijson")
+    url = dfour_server(snapshots=1, features=3)
+
+    async def read(storage):
+        pkg = await storage.read_package(snapshotHash="S0", lazy=True)
+        resource = pkg.to_copy().get_resource("points")
+        return resource.read_data(), resource.fullpath
+
+    data, path = run(url, read)
+    assert data == create_package(0, 3)["resources"][0]["data"]
+    assert not os.path.exists(path)
+
+
+# Write
+
+
+def test_aio_storage_write_package(dfour_server):
+    url = dfour_server(snapshots=2)
+    source = Package(create_package(1, 4))
+    source.title = "Snapshot 1"
+
+    async def write(storage):
+        await storage.write_package(source, force=True)
+        return await storage.read_package(snapshotHash="S1", cache=False)
+
+    pkg = run(url, write)
+    assert len(pkg.resources[0].data["features"]) == 4
+
+
+def test_aio_storage_write_package_new_titles_concurrently(dfour_server):
+    url = dfour_server(snapshots=1)
+    packages = [Package(create_package(number, 2)) for number in [7, 7, 8, 7]]
+
+    async def write(storage):
+        await asyncio.gather(
+            *[storage.write_package(pkg, force=True) for pkg in packages]
+        )
+        return [snapshot async for snapshot in storage]
+
+    requests.post(f"{url}/_reset")
+    snapshots = run(url, write, fetchSchema=False)
+    titles = [snapshot["title"] for snapshot in snapshots]
+    assert sorted(titles) == ["Snapshot 0", "Snapshot 7", "Snapshot 8"]
+
+    # One login, one listing, two mutations and the listing above
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["POST account"] == 1
+    assert stats["POST graphql"] == 4
+    assert stats["PATCH api"] == 4
+
+
+def test_aio_storage_write_package_expired_session(dfour_server):
+    url = dfour_server(snapshots=1)
+    source = Package(create_package(0, 2))
+
+    async def write(storage):
+        await storage.write_package(source, force=True)
+        requests.post(f"{url}/_expire")
+        requests.post(f"{url}/_reset")
+        await storage.write_package(source, force=True)
+
+    run(url, write)
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["POST account"] == 1
+    assert stats["PATCH api"] == 2
+
+
+def test_aio_storage_write_package_compression_rejected(dfour_server):
+    url = dfour_server(snapshots=1, reject_encoding=415)
+    source = Package(create_package(0, 5))
+
+    async def write(storage):
+        await storage.write_package(source, force=True)
+        return await storage.read_package(snapshotHash="S0", cache=False)
+
+    requests.post(f"{url}/_reset")
+    pkg = run(url, write, snapshotHash="S0", compression="gzip")
+    assert pkg == source
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["PATCH api"] == 2
+
+
+# Tracing
+
+
+def test_aio_storage_graphql_spans_record_status_and_bytes(dfour_server):
+    url = dfour_server(snapshots=1)
+
+    async def read(storage):
+        return await storage.read_package(snapshotHash="S0")
+
+    with tracing.collect() as spans:
+        run(url, read)
+    graphql = [span for span in spans if span.name == "graphql"]
+    assert [span.status for span in graphql] == [200]
+    assert graphql[0].bytes > 0
@@ -0,0 +1,147 @@
+import gc
+import io
+import os
+import json
+import pytest
+from frictionless_dfour import config, helpers
+from tests.server import create_package
+
+
+requires_ijson = pytest.mark.skipif(
+    not helpers.is_installed("ijson"), reason="ijson is not installed"
+)
+
+EDGE_CASES = [
+    {},
+    [],
+    {"empty": {}, "list": [], "nested": [[], {}, [{}]]},
+    {"name": "Zürich – ß", "emoji": "🗺", "escapes": "\"\\\n\t\u0001"},
+    [-0.0, 0.0, 1e100, -1e-100, 1.5, 0.1, 3.141592653589793],
+    [123456789012345678901234567890, -12345678901234567890123, 2**63, -(2**63) - 1],
+    [True, False, None, 0, -1, ""],
+]
+
+
+# Cache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = helpers.LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    cache.set("d", 4)
+    assert "a" not in cache
+    assert len(cache) == 2
+
+
+def test_lru_cache_disabled():
+    cache = helpers.LRUCache(0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_pop_and_clear():
+    cache = helpers.LRUCache()
+    for number in range(100):
+        cache.set(number, number)
+    assert len(cache) == 100
+    assert cache.pop(5) == 5
+    assert cache.pop(5) is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+# Load
+
+
+@pytest.mark.parametrize("value", EDGE_CASES)
+def test_loads_json_is_json_loads(value):
+    text = json.dumps(value)
+    assert json.dumps(helpers.loads_json(text)) == text
+    assert json.dumps(helpers.loads_json(text.encode("utf-8"))) == text
+
+
+@pytest.mark.parametrize("start", [0, config.CHUNK_SIZE - 10, config.CHUNK_SIZE - 1])
+def test_has_long_digits_across_blocks(start):
+    data = b" " * start + b"1" * 19 + b" " * 100
+    assert helpers.has_long_digits(data)
+    assert not helpers.has_long_digits(data.replace(b"1" * 19, b"1" * 18))
+
+
+@pytest.mark.parametrize("pause_gc", [False, True])
+def test_loads_json_leaves_gc_enabled(pause_gc):
+    assert helpers.loads_json(b'{"a": [1, 2]}', pause_gc=pause_gc) == {"a": [1, 2]}
+    assert gc.isenabled()
+
+
+# Encode
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_iter_json_keeps_non_finite_floats(fast):
+    package = create_package(0, 3)
+    features = package["resources"][0]["data"]["features"]
+    features[0]["properties"]["value"] = float("nan")
+    features[1]["properties"]["value"] = float("inf")
+    features[2]["properties"]["value"] = float("-inf")
+    text = "".join(helpers.iter_json(package, separators=(",", ":"), fast=fast))
+    assert json.dumps(json.loads(text)) == json.dumps(package)
+    assert "NaN" in text and "-Infinity" in text
+
+
+# Stream
+
+
+@requires_ijson
+def test_stream_json_perimeter_is_byte_identical():
+    with open("data/perimeter.json", "rb") as source:
+        data = json.load(source)
+        source.seek(0)
+        file = io.StringIO()
+        found, kept = helpers.stream_json(source, file)
+    assert found
+    assert kept == data
+    assert file.getvalue() == json.dumps(data, indent=4)
+
+
+@requires_ijson
+@pytest.mark.parametrize("value", EDGE_CASES)
+@pytest.mark.parametrize("indent", [4, None])
+def test_stream_json_edge_cases_are_byte_identical(value, indent):
+    source = io.BytesIO(json.dumps(value).encode("utf-8"))
+    file = io.StringIO()
+    found, kept = helpers.stream_json(source, file, indent=indent)
+    assert found
+    assert file.getvalue() == json.dumps(value, indent=indent)
+    assert json.dumps(kept) == json.dumps(value)
+
+
+@requires_ijson
+def test_stream_json_prefix_and_skip():
+    package = {"name": "a", "resources": [{"name": "r", "data": [2**70, -0.0, "ü"]}]}
+    document = {"data": {"snapshot": {"data": package}}}
+    source = io.BytesIO(json.dumps(document).encode("utf-8"))
+    file = io.StringIO()
+    found, kept = helpers.stream_json(
+        source, file, prefix="data.snapshot.data", skip=["resources.item.data"]
+    )
+    assert found
+    assert file.getvalue() == json.dumps(package, indent=4)
+    assert kept == {"name": "a", "resources": [{"name": "r"}]}
+
+
+@requires_ijson
+def test_spill_resources_big_numbers(tmp_path):
+    package = {"name": "a", "resources": [{"name": "r", "data": [[2**70, 1e100, -0.0]]}]}
+    source = io.BytesIO(json.dumps(package).encode("utf-8"))
+    found, descriptor = helpers.spill_resources(source, str(tmp_path))
+    assert found
+    assert descriptor["resources"] == [{"name": "r", "path": "resource-0.json"}]
+    with open(os.path.join(tmp_path, "resource-0.json")) as file:
+        assert file.read() == json.dumps(package["resources"][0]["data"])
@@ -0,0 +1,346 @@
+import gc
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+from graphql import introspection_from_schema
+from frictionless import Package, system
+from frictionless.exception import FrictionlessException
+from frictionless_dfour import DfourDialect, client, config, helpers, tracing
+from tests.server import SCHEMA, USERNAME, PASSWORD, WORKSPACE, create_package
+
+
+# Helpers
+
+
+def create_storage(url, **options):
+    dialect = DfourDialect(
+        workspaceHash=WORKSPACE,
+        username=USERNAME,
+        password=PASSWORD,
+        snapshotTopic="Test",
+        bfsMunicipality=261,
+        **options,
+    )
+    return system.create_storage("dfour", url, dialect=dialect)
+
+
+# Schema
+
+
+def test_storage_schema_cache_expires(dfour_server):
+    url = dfour_server(snapshots=1)
+    endpoint = f"{url}/graphql/"
+    create_storage(url).read_package(snapshotHash="S0")
+    client.close_sessions()
+    create_storage(url).read_package(snapshotHash="S0")
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["introspection"] == 1
+
+    # An entry older than `config.SCHEMA_TTL` is introspected again
+    path = client.schema_cache_path(endpoint)
+    with open(path) as file:
+        cached = json.load(file)
+    cached["fetched"] = time.time() - config.SCHEMA_TTL - 1
+    with open(path, "w") as file:
+        json.dump(cached, file)
+    client.close_sessions()
+    create_storage(url).read_package(snapshotHash="S0")
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["introspection"] == 2
+    assert client.read_schema_cache(path)["fetched"] > cached["fetched"]
+
+
+def test_storage_schema_cache_stale_is_refetched(dfour_server):
+    url = dfour_server(snapshots=1, features=2)
+    endpoint = f"{url}/graphql/"
+
+    # A cached schema from before `SnapshotNode.datafile` existed
+    introspection = introspection_from_schema(SCHEMA)
+    for type in introspection["__schema"]["types"]:
+        if type["name"] == "SnapshotNode":
+            type["fields"] = [f for f in type["fields"] if f["name"] != "datafile"]
+    client.close_sessions()
+    client.write_schema_cache(endpoint, introspection)
+
+    pkg = create_storage(url, httpCache=True).read_package(snapshotHash="S0")
+    assert pkg == Package(create_package(0, 2))
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["introspection"] == 1
+    cached = client.read_schema_cache(client.schema_cache_path(endpoint))
+    assert "datafile" in json.dumps(cached["introspection"])
+
+
+def test_storage_graphql_responses_parsed_by_loads_json(dfour_server):
+    url = dfour_server(snapshots=1)
+    create_storage(url, fetchSchema=False).read_package(snapshotHash="S0")
+    session = client.get_session(f"{url}/graphql/", schema=False)
+    assert session.transport.session.hooks["response"] == []
+    if not hasattr(session.transport, "json_deserialize"):
+        pytest.skip("gql < 3.5 parses responses with the stdlib")
+    assert session.transport.json_deserialize is helpers.loads_json
+
+
+# Cache
+
+
+def count_queries(url):
+    stats = requests.get(f"{url}/_stats").json()
+    requests.post(f"{url}/_reset")
+    return stats.get("POST graphql", 0)
+
+
+def test_storage_read_resource_reuses_cached_package(dfour_server):
+    url = dfour_server(snapshots=1, features=2)
+    storage = create_storage(url, fetchSchema=False)
+    pkg = storage.read_package(snapshotHash="S0")
+    assert count_queries(url) == 1
+    assert storage.read_package(snapshotHash="S0") is pkg
+    resource = storage.read_resource("points", snapshotHash="S0")
+    assert resource is pkg.get_resource("points")
+    assert count_queries(url) == 0
+
+
+def test_storage_cache_evicts_least_recently_read(dfour_server):
+    url = dfour_server(snapshots=3, features=2)
+    storage = create_storage(url, fetchSchema=False, cacheSize=2)
+    for hash in ["S0", "S1", "S0", "S2"]:
+        storage.read_package(snapshotHash=hash)
+    assert count_queries(url) == 3
+    storage.read_package(snapshotHash="S0")
+    storage.read_package(snapshotHash="S2")
+    assert count_queries(url) == 0
+    storage.read_package(snapshotHash="S1")
+    assert count_queries(url) == 1
+
+
+def test_storage_cache_disabled(dfour_server):
+    url = dfour_server(snapshots=1, features=2)
+    storage = create_storage(url, fetchSchema=False, cacheSize=0)
+    storage.read_package(snapshotHash="S0")
+    storage.read_resource("points", snapshotHash="S0")
+    assert count_queries(url) == 2
+
+
+def test_storage_clear_cache(dfour_server):
+    url = dfour_server(snapshots=2, features=2)
+    storage = create_storage(url, fetchSchema=False)
+    storage.read_package(snapshotHash="S0")
+    storage.read_package(snapshotHash="S1")
+    assert count_queries(url) == 2
+    storage.clear_cache("S0")
+    storage.read_package(snapshotHash="S0")
+    storage.read_package(snapshotHash="S1")
+    assert count_queries(url) == 1
+    storage.clear_cache()
+    storage.read_package(snapshotHash="S0")
+    storage.read_package(snapshotHash="S1")
+    assert count_queries(url) == 2
+
+
+# Write
+
+
+def test_storage_write_package_new_title(dfour_server):
+    url = dfour_server(snapshots=2)
+    storage = create_storage(url)
+    storage.write_package(Package(create_package(7, 3)), force=True)
+    titles = [snapshot["title"] for snapshot in create_storage(url)]
+    assert titles.count("Snapshot 7") == 1
+
+
+def test_storage_mutation_keeps_anonymous_session_clean(dfour_server):
+    url = dfour_server(snapshots=0)
+    storage = create_storage(url)
+    storage.write_package(Package(create_package(1, 3)), force=True)
+
+    # The mutation response sets cookies, they belong to the login session only
+    session = client.get_session(f"{url}/graphql/")
+    assert list(session.transport.session.cookies) == []
+    assert list(client.get_http().cookies) == []
+
+
+def test_storage_write_metadata_invalid_input_doesnt_login_again(dfour_server):
+    url = dfour_server(snapshots=1)
+    storage = create_storage(url, snapshotHash="S0")
+    storage.write_metadata("Renamed")
+    requests.post(f"{url}/_reset")
+    with pytest.raises(FrictionlessException) as excinfo:
+        storage.write_metadata(None)
+    assert "failed" in str(excinfo.value)
+    stats = requests.get(f"{url}/_stats").json()
+    assert "POST account" not in stats
+    assert stats["POST graphql"] == 1
+
+
+def test_storage_write_metadata_expired_session_logs_in_again(dfour_server):
+    url = dfour_server(snapshots=1)
+    storage = create_storage(url, snapshotHash="S0")
+    storage.write_metadata("Renamed")
+    requests.post(f"{url}/_expire")
+    requests.post(f"{url}/_reset")
+    storage.write_metadata("Renamed again")
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["POST account"] == 1
+    assert stats["POST graphql"] == 2
+
+
+def test_storage_write_package_shared_index(dfour_server):
+    url = dfour_server(snapshots=2)
+    requests.post(f"{url}/_reset")
+    index = helpers.SnapshotIndex()
+    packages = [Package(create_package(number, 3)) for number in [7, 8, 9, 7]]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(
+                create_storage(url, fetchSchema=False).write_package,
+                package,
+                force=True,
+                index=index,
+            )
+            for package in packages
+        ]
+        for future in futures:
+            future.result()
+
+    # One workspace listing and one mutation per new title
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["POST graphql"] == 4
+    titles = [snapshot["title"] for snapshot in create_storage(url)]
+    assert sorted(titles) == ["Snapshot 0", "Snapshot 1"] + [
+        f"Snapshot {number}" for number in [7, 8, 9]
+    ]
+
+
+# Upload retries
+
+
+@pytest.mark.parametrize("status", [400, 415])
+def test_storage_write_package_compression_rejected(dfour_server, status):
+    url = dfour_server(snapshots=1, reject_encoding=status)
+    source = Package(create_package(0, 5))
+    storage = create_storage(url, snapshotHash="S0", compression="gzip")
+    requests.post(f"{url}/_reset")
+    storage.write_package(source, force=True)
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["PATCH api"] == 2
+    pkg = storage.read_package(cache=False)
+    assert pkg == source
+
+    # Later uploads to the instance aren't compressed anymore
+    storage.write_package(source, force=True)
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["PATCH api"] == 3
+
+
+@pytest.mark.parametrize("redirect", [False, True])
+def test_storage_write_package_expired_session(dfour_server, redirect):
+    url = dfour_server(snapshots=1, login_redirect=redirect)
+    source = Package(create_package(0, 5))
+    storage = create_storage(url, snapshotHash="S0")
+    storage.write_package(Package(create_package(0, 2)), force=True)
+    requests.post(f"{url}/_expire")
+    requests.post(f"{url}/_reset")
+    storage.write_package(source, force=True)
+    stats = requests.get(f"{url}/_stats").json()
+    assert stats["POST account"] == 1
+    assert stats["PATCH api"] == 2
+    # The redirected upload and the new login both load the login page
+    assert stats["GET account"] == (2 if redirect else 1)
+    pkg = storage.read_package(cache=False)
+    assert pkg == source
+
+
+# Lazy data
+
+
+requires_ijson = pytest.mark.skipif(
+    not helpers.is_installed("ijson"), reason="ijson is not installed"
+)
+
+
+@requires_ijson
+def test_storage_read_package_lazy(dfour_server):
+    url = dfour_server(snapshots=1, features=3)
+    with create_storage(url) as storage:
+        pkg = storage.read_package(snapshotHash="S0", lazy=True)
+        resource = pkg.get_resource("points")
+        assert resource.data is None
+        assert os.path.exists(resource.fullpath)
+        assert resource.read_data() == create_package(0, 3)["resources"][0]["data"]
+    assert not os.path.exists(resource.fullpath)
+
+
+@requires_ijson
+def test_storage_read_package_lazy_copy_outlives_package(dfour_server):
+    url = dfour_server(snapshots=1, features=3)
+    storage = create_storage(url)
+    pkg = storage.read_package(snapshotHash="S0", lazy=True, cache=False)
+    copy = pkg.to_copy()
+    del pkg
+    gc.collect()
+    data = copy.get_resource("points").read_data()
+    assert data == create_package(0, 3)["resources"][0]["data"]
+
+    # The files are removed with the storage
+    path = copy.get_resource("points").fullpath
+    del storage
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+@requires_ijson
+def test_storage_write_package_lazy(dfour_server):
+    url = dfour_server(snapshots=2, features=3)
+    with create_storage(url) as storage:
+        pkg = storage.read_package(snapshotHash="S0", lazy=True)
+        create_storage(url, snapshotHash="S1").write_package(pkg.to_copy(), force=True)
+    pkg = create_storage(url).read_package(snapshotHash="S1")
+    resource = pkg.get_resource("points")
+    assert "path" not in resource
+    assert resource.data == create_package(0, 3)["resources"][0]["data"]
+
+
+# Http cache
+
+
+def test_storage_http_cache_removes_replaced_blobs(dfour_server, tmp_path):
+    url = dfour_server(snapshots=2, features=2)
+    blobs = tmp_path / "cache" / "blobs"
+    storage = create_storage(url, httpCache=True)
+    storage.read_package(snapshotHash="S0")
+    storage.read_package(snapshotHash="S1")
+    assert len(os.listdir(blobs)) == 2
+
+    # The new datafile of S1 has the same content as the one of S0
+    create_storage(url, snapshotHash="S1").write_package(
+        Package(create_package(0, 2)), force=True
+    )
+    storage.read_package(snapshotHash="S1", cache=False)
+    assert len(os.listdir(blobs)) == 1
+
+    # Replacing S0 keeps the blob S1 still refers to
+    create_storage(url, snapshotHash="S0").write_package(
+        Package(create_package(0, 5)), force=True
+    )
+    pkg = storage.read_package(snapshotHash="S0", cache=False)
+    assert len(pkg.resources[0].data["features"]) == 5
+    assert len(os.listdir(blobs)) == 2
+    pkg = storage.read_package(snapshotHash="S1", cache=False)
+    assert len(pkg.resources[0].data["features"]) == 2
+
+
+# Tracing
+
+
+def test_storage_graphql_spans_record_status_and_bytes(dfour_server):
+    url = dfour_server(snapshots=1)
+    with tracing.collect() as spans:
+        create_storage(url).read_package(snapshotHash="S0")
+    graphql = [span for span in spans if span.name == "graphql"]
+    assert [span.status for span in graphql] == [200]
+    assert graphql[0].bytes > 0
+    introspection = [span for span in spans if span.name == "introspection"]
+    assert [span.status for span in introspection] == [200]